@@ -0,0 +1,164 @@
+# Author: Lovro Bosnar
+
+# Headless batch runner for procedural_3d_curve_from_drawing.py.
+# Generates every preset/seed variant in one Blender process: variant is generated into scene of loaded .blend,
+# saved (and optionally rendered), then everything it generated is removed before next variant.
+# Presets are JSON files of main() parameters in presets/ (name) or anywhere (path).
+#
+#   blender -b curve_draw_3d.blend --python curve_draw_batch.py -- --preset exp5 --seed 1 2 3
+#   blender -b curve_draw_3d.blend --python curve_draw_batch.py -- --preset exp1 exp7 --seed 0 --render --frame-end 100
+#   blender -b curve_draw_3d.blend --python curve_draw_batch.py -- --preset exp3 --set mball_motion='"flow"'
+#
+# With --worker jobs are read from stdin as JSON lines, see curve_draw_farm.py.
+
+import argparse
+import inspect
+import itertools
+import json
+import os
+import sys
+import time
+import traceback
+import bpy
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.append(script_dir)
+
+import curve_draw_farm
+import procedural_3d_curve_from_drawing as curve_draw
+
+PRESET_DIR = os.path.join(script_dir, "presets")
+
+# bpy.data collections main() adds datablocks to. Reset removes their datablocks which were not there before.
+GENERATED_ID_COLLECTIONS = ("objects", "curves", "metaballs", "meshes", "materials", "actions", "node_groups", "collections")
+
+def get_preset_path(preset):
+    if os.path.isfile(preset):
+        return preset
+    return os.path.join(PRESET_DIR, preset + ".json")
+
+def get_preset_name(preset):
+    return os.path.splitext(os.path.basename(preset))[0]
+
+# Parameters of main() from preset, unknown parameter names are error.
+def load_preset(preset):
+    with open(get_preset_path(preset)) as f:
+        params = json.load(f)
+    check_params(params, preset)
+    return params
+
+def check_params(params, source):
+    unknown = set(params) - set(inspect.signature(curve_draw.main).parameters)
+    if unknown:
+        raise ValueError("Unknown main() parameters in {}: {}".format(source, ", ".join(sorted(unknown))))
+
+# Names of datablocks in GENERATED_ID_COLLECTIONS.
+def snapshot_ids():
+    return {attr: set(getattr(bpy.data, attr).keys()) for attr in GENERATED_ID_COLLECTIONS}
+
+# Remove everything generated since snapshot (and generation handlers) in one call.
+def reset_scene(snapshot):
+    curve_draw.remove_mball_lod_handler()
+    generated = []
+    for attr in GENERATED_ID_COLLECTIONS:
+        generated += [id_data for id_data in getattr(bpy.data, attr) if id_data.name not in snapshot[attr]]
+    bpy.data.batch_remove(generated)
+
+def get_variant_name(preset, seed):
+    return "{}_seed{}".format(get_preset_name(preset), seed)
+
+# Generate variant, save it as .blend to output_dir (unless save_blend is False) and render frames
+# [frame_start, frame_end] to output_dir/<variant>/. Returns path of saved .blend, or render directory if not saved.
+# name is variant name, by default from preset and seed.
+def run_variant(preset, params, seed, output_dir, render=False, frame_start=None, frame_end=None, save_blend=True, name=None):
+    start = time.perf_counter()
+    curve_draw.main(**dict(params, seed=seed))
+    name = name or get_variant_name(preset, seed)
+    os.makedirs(output_dir, exist_ok=True)
+    output = os.path.join(output_dir, name, "")
+    if save_blend:
+        output = os.path.join(output_dir, name + ".blend")
+        bpy.ops.wm.save_as_mainfile(filepath=output, copy=True)
+    if render:
+        scene = bpy.context.scene
+        frame_range = (scene.frame_start, scene.frame_end, scene.render.filepath)
+        try:
+            if frame_start is not None:
+                scene.frame_start = frame_start
+            if frame_end is not None:
+                scene.frame_end = frame_end
+            scene.render.filepath = os.path.join(output_dir, name, "")
+            bpy.ops.render.render(animation=True)
+        finally:
+            scene.frame_start, scene.frame_end, scene.render.filepath = frame_range
+    print("Variant {} done in {:.1f} s: {}".format(name, time.perf_counter() - start, output))
+    return output
+
+# Arguments after "--" on Blender command line.
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="curve_draw_batch.py", description="Generate preset/seed variants of procedural curve drawing.")
+    parser.add_argument("--preset", nargs="+", default=[], help="Preset names in presets/ or paths to JSON files.")
+    parser.add_argument("--seed", nargs="+", type=int, default=[0], help="Run seeds, every preset is generated with every seed.")
+    parser.add_argument("--output-dir", default="//batch", help="Output directory, // is directory of .blend.")
+    parser.add_argument("--render", action="store_true", help="Render animation of every variant.")
+    parser.add_argument("--frame-start", type=int, default=None)
+    parser.add_argument("--frame-end", type=int, default=None)
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=JSON", help="Override main() parameter of every preset.")
+    parser.add_argument("--worker", action="store_true", help="Run jobs read from stdin instead of presets and seeds.")
+    args = parser.parse_args(argv)
+    if not args.preset and not args.worker:
+        parser.error("--preset is required")
+    return args
+
+def parse_overrides(assignments):
+    overrides = {}
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        overrides[name] = json.loads(value)
+    check_params(overrides, "--set")
+    return overrides
+
+# Worker of curve_draw_farm.py: run job {"id", "name", "preset", "seed", "render", "frame_start", "frame_end", "save_blend", "set"}
+# from every stdin line and print result {"id", "output"} or {"id", "error"} line, until stdin is closed.
+def run_worker(output_dir):
+    snapshot = snapshot_ids()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        try:
+            params = dict(load_preset(job["preset"]), **job.get("set", {}))
+            check_params(params, job["id"])
+            output = run_variant(job["preset"], params, job["seed"], output_dir, job.get("render", False), job.get("frame_start"), job.get("frame_end"),
+                job.get("save_blend", True), job.get("name"))
+            result = {"id": job["id"], "output": output}
+        except Exception:
+            result = {"id": job["id"], "error": traceback.format_exc()}
+        finally:
+            reset_scene(snapshot)
+        print(curve_draw_farm.WORKER_RESULT_PREFIX + json.dumps(result), flush=True)
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_dir = bpy.path.abspath(args.output_dir)
+    if args.worker:
+        run_worker(output_dir)
+        return
+    overrides = parse_overrides(args.set)
+    # Load presets up front, so typo does not fail batch half way.
+    presets = [(preset, dict(load_preset(preset), **overrides)) for preset in args.preset]
+    snapshot = snapshot_ids()
+    for (preset, params), seed in itertools.product(presets, args.seed):
+        try:
+            run_variant(preset, params, seed, output_dir, args.render, args.frame_start, args.frame_end)
+        finally:
+            reset_scene(snapshot)
+
+#
+# Script entry point.
+#
+if __name__ == "__main__":
+    main()
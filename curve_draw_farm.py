@@ -0,0 +1,267 @@
+# Author: Lovro Bosnar
+
+# Local farm of background Blender workers for curve_draw_batch.py. Run with plain Python (no bpy):
+#
+#   python curve_draw_farm.py --blend curve_draw_3d.blend --preset exp1 exp5 --seed-range 0 50 --workers 8
+#   python curve_draw_farm.py --blend curve_draw_3d.blend --preset exp3 --seed 7 --render --frame-start 1 --frame-end 300 --frame-chunk 50
+#
+# Every worker is one "blender -b" process which loads .blend once and then takes (preset, seed, frame range) jobs
+# from queue one by one (see curve_draw_batch.py --worker). Failed or timed out jobs are retried, timed out worker
+# is killed and restarted. State of every job is kept in manifest on disk, so interrupted farm continues
+# where it stopped when started again with same arguments.
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+# Worker prints job result as single line with this prefix, everything else on its stdout is Blender log.
+WORKER_RESULT_PREFIX = "curve_draw_batch result: "
+
+BATCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "curve_draw_batch.py")
+
+# Variant name, with short stable hash of overrides, so variants with other --set values get other names.
+def get_variant_name(preset, seed, overrides=None):
+    name = "{}_seed{}".format(os.path.splitext(os.path.basename(preset))[0], seed)
+    if overrides:
+        name += "_" + hashlib.sha1(json.dumps(overrides, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    return name
+
+def get_job_id(preset, seed, frame_start=None, frame_end=None, overrides=None):
+    job_id = get_variant_name(preset, seed, overrides)
+    if frame_start is not None or frame_end is not None:
+        job_id += "_{}-{}".format(frame_start, frame_end)
+    return job_id
+
+# Jobs for every preset and seed, rendered frames split into chunks of frame_chunk frames.
+# Every chunk job generates the variant to render it, but only the first one saves its .blend.
+def create_jobs(presets, seeds, render=False, frame_start=None, frame_end=None, frame_chunk=None, overrides=None):
+    if render and frame_chunk and frame_start is not None and frame_end is not None:
+        frame_ranges = [(start, min(start + frame_chunk - 1, frame_end)) for start in range(frame_start, frame_end + 1, frame_chunk)]
+    else:
+        frame_ranges = [(frame_start, frame_end)]
+    jobs = []
+    for preset in presets:
+        for seed in seeds:
+            for i, (start, end) in enumerate(frame_ranges):
+                jobs.append({"id": get_job_id(preset, seed, start, end, overrides), "name": get_variant_name(preset, seed, overrides), "preset": preset, "seed": seed,
+                    "render": render, "frame_start": start, "frame_end": end, "save_blend": i == 0, "set": overrides or {}})
+    return jobs
+
+# Job states on disk: job id -> {"job", "status" ("pending", "done", "failed"), "attempts", "error", "output", "seconds"}.
+# Saved after every change by writing temporary file and replacing manifest, so it is never half written.
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.records = json.load(f)
+
+    # Add jobs not in manifest yet. Job already in manifest with other parameters (e.g. from older version) is error,
+    # instead of being skipped as done or run with its stored parameters.
+    def add_jobs(self, jobs):
+        with self.lock:
+            for job in jobs:
+                record = self.records.get(job["id"])
+                if record is not None and record["job"] != job:
+                    raise ValueError("Job {} in manifest {} has other parameters, use another --manifest or --output-dir.".format(job["id"], self.path))
+            for job in jobs:
+                self.records.setdefault(job["id"], {"job": job, "status": "pending", "attempts": 0})
+            self.save()
+
+    # Given jobs still to do. Failed jobs get another round of retries on resume.
+    def pending_jobs(self, job_ids):
+        with self.lock:
+            records = [self.records[job_id] for job_id in job_ids]
+            for record in records:
+                if record["status"] == "failed":
+                    record["status"] = "pending"
+                    record["attempts"] = 0
+            return [record["job"] for record in records if record["status"] == "pending"]
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.records[job_id].update(fields)
+            self.save()
+            return dict(self.records[job_id])
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.records, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def count(self, status):
+        with self.lock:
+            return sum(1 for record in self.records.values() if record["status"] == status)
+
+# One background Blender process running curve_draw_batch.py in worker mode. Output which is not job result
+# goes to log_path. Process is (re)started when needed.
+class BlenderWorker:
+    def __init__(self, command, log_path):
+        self.command = command
+        self.log_path = log_path
+        self.process = None
+
+    def start(self):
+        self.results = queue.Queue()
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        threading.Thread(target=self.read_output, args=(self.process, self.results, open(self.log_path, "a")), daemon=True).start()
+
+    @staticmethod
+    def read_output(process, results, log):
+        for line in process.stdout:
+            if line.startswith(WORKER_RESULT_PREFIX):
+                results.put(json.loads(line[len(WORKER_RESULT_PREFIX):]))
+            else:
+                log.write(line)
+                log.flush()
+        # Process exited.
+        log.close()
+        results.put(None)
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    # Run job, returns result dict with "output" or "error".
+    def run(self, job, timeout=None):
+        try:
+            if not self.is_running():
+                self.start()
+            self.process.stdin.write(json.dumps(job) + "\n")
+            self.process.stdin.flush()
+            result = self.results.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            return {"id": job["id"], "error": "timeout after {} s".format(timeout)}
+        except (BrokenPipeError, OSError) as e:
+            # Also Blender which could not be started (wrong path, no permission).
+            self.kill()
+            return {"id": job["id"], "error": "worker error: {}".format(e)}
+        if result is None:
+            returncode = self.process.wait()
+            self.kill()
+            return {"id": job["id"], "error": "worker exited with code {}".format(returncode)}
+        return result
+
+    def kill(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    # Closing stdin ends worker loop and Blender exits.
+    def stop(self):
+        if self.is_running():
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                pass
+        self.kill()
+
+# Run jobs from job_queue on worker until None, retrying failed jobs up to retries times.
+def worker_loop(worker, job_queue, manifest, retries, timeout):
+    while True:
+        job = job_queue.get()
+        if job is None:
+            job_queue.task_done()
+            break
+        # task_done even if something here raises, otherwise run_farm waits on job_queue.join() forever.
+        try:
+            start = time.perf_counter()
+            result = worker.run(job, timeout)
+            seconds = round(time.perf_counter() - start, 1)
+            attempts = manifest.records[job["id"]]["attempts"] + 1
+            if "error" not in result:
+                manifest.update(job["id"], status="done", attempts=attempts, output=result.get("output"), seconds=seconds, error=None)
+                print("Done {} in {} s.".format(job["id"], seconds))
+            elif attempts <= retries:
+                manifest.update(job["id"], attempts=attempts, error=result["error"])
+                print("Retrying {} ({} of {}): {}".format(job["id"], attempts, retries, result["error"].strip().splitlines()[-1]))
+                job_queue.put(job)
+            else:
+                manifest.update(job["id"], status="failed", attempts=attempts, error=result["error"], seconds=seconds)
+                print("Failed {}: {}".format(job["id"], result["error"].strip().splitlines()[-1]))
+        finally:
+            job_queue.task_done()
+    worker.stop()
+
+def run_farm(jobs, blender, blend, output_dir, n_workers, retries=2, timeout=None, manifest_path=None, threads_per_worker=None):
+    os.makedirs(os.path.join(output_dir, "logs"), exist_ok=True)
+    manifest = Manifest(manifest_path or os.path.join(output_dir, "manifest.json"))
+    manifest.add_jobs(jobs)
+    pending = manifest.pending_jobs([job["id"] for job in jobs])
+    print("{} jobs, {} already done, {} to run on {} workers.".format(len(jobs), len(jobs) - len(pending), len(pending), n_workers))
+    if not pending:
+        return manifest
+    if threads_per_worker is None:
+        threads_per_worker = max((os.cpu_count() or 1) // n_workers, 1)
+    job_queue = queue.Queue()
+    for job in pending:
+        job_queue.put(job)
+    threads = []
+    for i in range(min(n_workers, len(pending))):
+        command = [blender, "-b", blend, "-t", str(threads_per_worker), "--python", BATCH_SCRIPT, "--", "--worker", "--output-dir", output_dir]
+        worker = BlenderWorker(command, os.path.join(output_dir, "logs", "worker_{}.log".format(i)))
+        thread = threading.Thread(target=worker_loop, args=(worker, job_queue, manifest, retries, timeout))
+        thread.start()
+        threads.append(thread)
+    # Retried jobs are put back before their task_done, so join returns after last attempt of every job.
+    job_queue.join()
+    for thread in threads:
+        job_queue.put(None)
+    for thread in threads:
+        thread.join()
+    print("{} jobs done, {} failed.".format(manifest.count("done"), manifest.count("failed")))
+    return manifest
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="curve_draw_farm.py", description="Generate preset/seed variants on parallel background Blender workers.")
+    parser.add_argument("--blender", default="blender", help="Blender executable.")
+    parser.add_argument("--blend", required=True, help="Base .blend loaded by every worker.")
+    parser.add_argument("--preset", nargs="+", required=True, help="Preset names in presets/ or paths to JSON files.")
+    parser.add_argument("--seed", nargs="+", type=int, default=[], help="Run seeds.")
+    parser.add_argument("--seed-range", nargs=2, type=int, metavar=("START", "STOP"), help="Run seeds START to STOP - 1.")
+    parser.add_argument("--output-dir", default="farm", help="Output directory for .blend files, renders, logs and manifest.")
+    parser.add_argument("--manifest", default=None, help="Manifest path, default is manifest.json in output directory.")
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 1) // 4, 1), help="Number of Blender processes.")
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="Blender threads of every worker, default splits cores between workers.")
+    parser.add_argument("--retries", type=int, default=2, help="Retries of failed or timed out job.")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds after which job is killed and retried.")
+    parser.add_argument("--render", action="store_true", help="Render animation of every variant.")
+    parser.add_argument("--frame-start", type=int, default=None)
+    parser.add_argument("--frame-end", type=int, default=None)
+    parser.add_argument("--frame-chunk", type=int, default=None, help="Frames rendered per job.")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=JSON", help="Override main() parameter of every preset.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    seeds = list(args.seed)
+    if args.seed_range is not None:
+        seeds += list(range(*args.seed_range))
+    if not seeds:
+        seeds = [0]
+    overrides = {}
+    for assignment in args.set:
+        name, _, value = assignment.partition("=")
+        overrides[name] = json.loads(value)
+    output_dir = os.path.abspath(args.output_dir)
+    jobs = create_jobs(args.preset, seeds, args.render, args.frame_start, args.frame_end, args.frame_chunk, overrides)
+    manifest = run_farm(jobs, args.blender, os.path.abspath(args.blend), output_dir, args.workers, args.retries, args.timeout, args.manifest, args.threads_per_worker)
+    return 1 if manifest.count("failed") else 0
+
+#
+# Script entry point.
+#
+if __name__ == "__main__":
+    sys.exit(main())
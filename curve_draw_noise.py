@@ -0,0 +1,270 @@
+# Author: Lovro Bosnar
+
+# Pure NumPy noise for procedural_3d_curve_from_drawing.py.
+# Follows mathutils.noise noise_vector / turbulence_vector with PERLIN_ORIGINAL basis,
+# but evaluates whole (N,3) arrays of points in one call and does not need Blender.
+# Run as script for a small benchmark: python curve_draw_noise.py
+
+import collections
+import functools
+import itertools
+import numpy as np
+
+# Size of permutation table (lattice repeats after this many cells).
+TABLE_SIZE = 256
+
+# Corners of unit cell.
+CELL_CORNERS = np.array(list(itertools.product((0, 1), repeat=3)), dtype=np.int64)
+
+# Permutation table, random unit gradients and per component offsets for given seed.
+@functools.lru_cache(maxsize=16)
+def noise_tables(seed=0):
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(TABLE_SIZE)
+    perm = np.concatenate((perm, perm))
+    # Original Perlin: random gradients on unit sphere.
+    gradients = rng.normal(size=(TABLE_SIZE, 3))
+    gradients /= np.linalg.norm(gradients, axis=1, keepdims=True)
+    # Vector noise samples scalar noise at 3 offset positions (as Blender does).
+    offsets = rng.uniform(-100.0, 100.0, size=(3, 3))
+    return perm, gradients, offsets
+
+# Original Perlin interpolant 3t^2 - 2t^3.
+def s_curve(t):
+    return t * t * (3.0 - 2.0 * t)
+
+# Signed gradient noise in about [-1,1] for (N,3) points. Returns (N,).
+def perlin_noise(points, seed=0):
+    perm, gradients, _ = noise_tables(seed)
+    p = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    cell = np.floor(p)
+    frac = p - cell
+    cell = cell.astype(np.int64) & (TABLE_SIZE - 1)
+    weights = s_curve(frac)
+    result = np.zeros(len(p))
+    for corner in CELL_CORNERS:
+        idx = perm[perm[perm[cell[:, 0] + corner[0]] + cell[:, 1] + corner[1]] + cell[:, 2] + corner[2]]
+        dot = np.einsum("ij,ij->i", gradients[idx], frac - corner)
+        w = np.where(corner == 1, weights, 1.0 - weights).prod(axis=1)
+        result += w * dot
+    # Unit gradients give range [-sqrt(3)/2, sqrt(3)/2].
+    return result * (2.0 / np.sqrt(3.0))
+
+# Vector noise for (N,3) points. Returns (N,3).
+def noise_vector(points, seed=0):
+    _, _, offsets = noise_tables(seed)
+    p = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    # All 3 components in one noise evaluation.
+    shifted = (p[np.newaxis, :, :] + offsets[:, np.newaxis, :]).reshape(-1, 3)
+    return perlin_noise(shifted, seed).reshape(3, -1).T
+
+# Multi octave vector noise for (N,3) points. Returns (N,3).
+# Same parameters as mathutils.noise.turbulence_vector.
+def turbulence_vector(points, n_octaves, hard=False, amplitude_scale=0.5, frequency_scale=2.0, seed=0):
+    p = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    amp = 1.0
+    result = np.zeros_like(p)
+    for octave in range(max(n_octaves, 1)):
+        n = noise_vector(p, seed)
+        if hard:
+            n = np.abs(n)
+        result += amp * n
+        amp *= amplitude_scale
+        p = p * frequency_scale
+    return result
+
+# Grid shape of noise volume over box [bb_min, bb_max]: samples_per_unit samples per noise lattice cell
+# of the highest octave (frequency_scale**(n_octaves-1)), at least 2 per axis.
+def noise_volume_shape(bb_min, bb_max, n_octaves, frequency_scale=2.0, samples_per_unit=4.0):
+    extent = np.maximum(np.asarray(bb_max, dtype=np.float64) - np.asarray(bb_min, dtype=np.float64), 1e-6)
+    density = samples_per_unit * abs(frequency_scale) ** (max(n_octaves, 1) - 1)
+    shape = np.maximum(np.ceil(extent * density).astype(np.int64) + 1, 2)
+    return tuple(int(size) for size in shape)
+
+# Turbulence precomputed on regular grid of given (rx,ry,rz) shape over box [bb_min, bb_max].
+# Returns (rx,ry,rz,3) float32 array.
+def build_noise_volume(bb_min, bb_max, shape, n_octaves, hard=False, amplitude_scale=0.5, frequency_scale=2.0, seed=0):
+    bb_min = np.asarray(bb_min, dtype=np.float64)
+    bb_max = np.asarray(bb_max, dtype=np.float64)
+    axes = [np.linspace(bb_min[i], bb_max[i], shape[i]) for i in range(3)]
+    volume = np.empty(tuple(shape) + (3,), dtype=np.float32)
+    # Evaluate slabs of about 2^18 samples, so temporaries stay small for large volumes.
+    slab = max(2**18 // (shape[1] * shape[2]), 1)
+    for start in range(0, shape[0], slab):
+        grid = np.stack(np.meshgrid(axes[0][start:start + slab], axes[1], axes[2], indexing="ij"), axis=-1).reshape(-1, 3)
+        volume[start:start + slab] = turbulence_vector(grid, n_octaves, hard, amplitude_scale, frequency_scale, seed).reshape(-1, shape[1], shape[2], 3)
+    return volume
+
+# Trilinear interpolation of volume built over [bb_min, bb_max] at (N,3) points. Points outside are clamped.
+def sample_noise_volume(volume, bb_min, bb_max, points):
+    p = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    shape = np.array(volume.shape[:3])
+    bb_min = np.asarray(bb_min, dtype=np.float64)
+    extent = np.maximum(np.asarray(bb_max, dtype=np.float64) - bb_min, 1e-6)
+    grid_co = np.clip((p - bb_min) / extent * (shape - 1), 0.0, shape - 1)
+    cell = np.minimum(np.floor(grid_co).astype(np.int64), shape - 2)
+    frac = grid_co - cell
+    result = np.zeros((len(p), volume.shape[3]))
+    for corner in CELL_CORNERS:
+        w = np.where(corner == 1, frac, 1.0 - frac).prod(axis=1)
+        idx = cell + corner
+        result += w[:, np.newaxis] * volume[idx[:, 0], idx[:, 1], idx[:, 2]]
+    return result
+
+# Noise volumes keyed by box and noise parameters, sampled samples_per_unit times per cell of the highest
+# octave (see noise_volume_shape). Least recently used volumes are evicted once total size exceeds max_bytes.
+# Building a sample costs about as much as evaluating noise at a point, and a lookup about a quarter of it,
+# so volume is only built if it has at most max_samples_per_query samples per expected query (None: always).
+class NoiseVolumeCache:
+    def __init__(self, samples_per_unit=4.0, max_bytes=256 * 2**20, max_samples_per_query=0.5):
+        self.samples_per_unit = samples_per_unit
+        self.max_bytes = max_bytes
+        self.max_samples_per_query = max_samples_per_query
+        self.volumes = collections.OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.skips = 0
+
+    # Volume over box, or None if building it would cost more than evaluating noise at n_queries points directly
+    # (or it would not fit in max_bytes). n_queries is number of lookups expected in this box, e.g. over all instances.
+    def get(self, bb_min, bb_max, n_octaves, hard=False, amplitude_scale=0.5, frequency_scale=2.0, seed=0, n_queries=None):
+        # Round box so tiny float differences still hit same volume.
+        bb_min = tuple(np.round(np.asarray(bb_min, dtype=np.float64), 4))
+        bb_max = tuple(np.round(np.asarray(bb_max, dtype=np.float64), 4))
+        key = (bb_min, bb_max, n_octaves, bool(hard), float(amplitude_scale), float(frequency_scale), seed)
+        volume = self.volumes.get(key)
+        if volume is not None:
+            self.hits += 1
+            self.volumes.move_to_end(key)
+            return volume
+        shape = noise_volume_shape(bb_min, bb_max, n_octaves, frequency_scale, self.samples_per_unit)
+        n_samples = int(np.prod(shape))
+        # 3 float32 components per sample.
+        too_costly = self.max_samples_per_query is not None and n_queries is not None and n_samples > self.max_samples_per_query * n_queries
+        if too_costly or n_samples * 12 > self.max_bytes:
+            self.skips += 1
+            return None
+        self.misses += 1
+        volume = build_noise_volume(bb_min, bb_max, shape, n_octaves, hard, amplitude_scale, frequency_scale, seed)
+        self.volumes[key] = volume
+        self.n_bytes += volume.nbytes
+        # Keep at least the volume just built.
+        while self.n_bytes > self.max_bytes and len(self.volumes) > 1:
+            _, evicted = self.volumes.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+        return volume
+
+    # Same as turbulence_vector, but sampled from cached volume over [bb_min, bb_max] (evaluated directly if volume
+    # is not worth building for n_queries, by default number of points).
+    def turbulence_vector(self, points, bb_min, bb_max, n_octaves, hard=False, amplitude_scale=0.5, frequency_scale=2.0, seed=0, n_queries=None):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        volume = self.get(bb_min, bb_max, n_octaves, hard, amplitude_scale, frequency_scale, seed, len(points) if n_queries is None else n_queries)
+        if volume is None:
+            return turbulence_vector(points, n_octaves, hard, amplitude_scale, frequency_scale, seed)
+        # Use rounded box the volume was built with.
+        bb_min = np.round(np.asarray(bb_min, dtype=np.float64), 4)
+        bb_max = np.round(np.asarray(bb_max, dtype=np.float64), 4)
+        return sample_noise_volume(volume, bb_min, bb_max, points)
+
+    def clear(self):
+        self.volumes.clear()
+        self.n_bytes = 0
+
+# Box of noise volume for curve_perturbation_offsets: scaled points co and origin, rounded as in NoiseVolumeCache.
+def curve_perturbation_box(co, perturb_scale=1.0):
+    scaled_co = np.asarray(co, dtype=np.float64).reshape(-1, 3) * perturb_scale
+    bb_min = np.round(np.minimum(scaled_co.min(axis=0), 0.0), 4)
+    bb_max = np.round(np.maximum(scaled_co.max(axis=0), 0.0), 4)
+    return bb_min, bb_max
+
+# Noise volume of curve_perturbation_offsets for points co from noise_cache, e.g. to share it with other processes.
+# n_uses is number of curve_perturbation_offsets calls expected for co (e.g. instances). None if not worth building.
+def curve_perturbation_volume(co, noise_cache, perturb_scale=1.0, n_octaves=1, amplitude_scale=1.0, frequency_scale=1.0, noise_seed=0, n_uses=1):
+    bb_min, bb_max = curve_perturbation_box(co, perturb_scale)
+    return noise_cache.get(bb_min, bb_max, n_octaves, False, amplitude_scale, frequency_scale, noise_seed, n_queries=(len(co) - 1) * n_uses)
+
+# Offsets of (N,3) curve points co: turbulence sampled at every point scaled towards origin by random factor
+# (from seed), times perturb_strength. First point stays in place. With noise_cache (or its noise_volume from
+# curve_perturbation_volume) turbulence is sampled from volume spanning scaled points and origin, if volume is
+# worth building for noise_cache_uses calls with same co. Returns (N,3) float32.
+def curve_perturbation_offsets(co, perturb_scale=1.0, perturb_strength=1.0, n_octaves=1, amplitude_scale=1.0, frequency_scale=1.0, seed=0, noise_seed=0, noise_cache=None, noise_volume=None, noise_cache_uses=1):
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    offsets = np.zeros((len(co), 3), dtype=np.float32)
+    if len(co) < 2:
+        return offsets
+    rng = np.random.default_rng(seed)
+    sample_co = co[1:] * perturb_scale * rng.random((len(co) - 1, 1))
+    if noise_cache is not None and noise_volume is None:
+        noise_volume = curve_perturbation_volume(co, noise_cache, perturb_scale, n_octaves, amplitude_scale, frequency_scale, noise_seed, noise_cache_uses)
+    if noise_volume is None:
+        offsets[1:] = turbulence_vector(sample_co, n_octaves, False, amplitude_scale, frequency_scale, noise_seed) * perturb_strength
+    else:
+        bb_min, bb_max = curve_perturbation_box(co, perturb_scale)
+        offsets[1:] = sample_noise_volume(noise_volume, bb_min, bb_max, sample_co) * perturb_strength
+    return offsets
+
+# Compare curve_perturbation_offsets of random curve spanning box of given extent with and without noise_cache.
+# Prints and returns (mean error, max error, mean displacement) of cached offsets.
+def check_noise_cache(extent=40.0, n_points=5000, n_curves=8, n_octaves=2, frequency_scale=2.0, noise_cache=None):
+    rng = np.random.default_rng(0)
+    # Volume is always built, so accuracy is measured even where it would be skipped.
+    noise_cache = noise_cache if noise_cache is not None else NoiseVolumeCache(max_samples_per_query=None)
+    errors = []
+    displacements = []
+    for seed in range(n_curves):
+        co = np.cumsum(rng.normal(size=(n_points, 3)), axis=0)
+        co = (co - co.min(axis=0)) / np.ptp(co, axis=0).max() * extent
+        direct = curve_perturbation_offsets(co, n_octaves=n_octaves, frequency_scale=frequency_scale, seed=seed)
+        cached = curve_perturbation_offsets(co, n_octaves=n_octaves, frequency_scale=frequency_scale, seed=seed, noise_cache=noise_cache)
+        errors.append(np.linalg.norm(cached - direct, axis=1))
+        displacements.append(np.linalg.norm(direct, axis=1))
+    errors = np.concatenate(errors)
+    result = (float(errors.mean()), float(errors.max()), float(np.concatenate(displacements).mean()))
+    print("NoiseVolumeCache error on {} unit box: mean {:.4f}, max {:.4f}, mean displacement {:.4f}".format(extent, *result))
+    return result
+
+# Time n_instances perturbations of same n_points curve spanning box of every extent, with main()'s noise settings,
+# evaluated directly and with fresh NoiseVolumeCache (volume build included), to show where cache pays off.
+def benchmark_noise_cache(extents=(5.0, 10.0, 20.0), n_points=500, n_instances=80, n_octaves=2, frequency_scale=2.0):
+    import time
+    rng = np.random.default_rng(0)
+    for extent in extents:
+        co = np.cumsum(rng.normal(size=(n_points, 3)), axis=0)
+        co = (co - co.min(axis=0)) / np.ptp(co, axis=0).max() * extent
+        timings = []
+        cache = NoiseVolumeCache()
+        for noise_cache in (None, cache, NoiseVolumeCache(max_samples_per_query=None)):
+            start = time.perf_counter()
+            for seed in range(n_instances):
+                curve_perturbation_offsets(co, n_octaves=n_octaves, frequency_scale=frequency_scale, seed=seed, noise_cache=noise_cache, noise_cache_uses=n_instances)
+            timings.append(time.perf_counter() - start)
+        shape = noise_volume_shape(*curve_perturbation_box(co), n_octaves, frequency_scale)
+        print("{} x {} points on {} unit box: direct {:.3f} s, cache {:.3f} s ({}), forced cache {:.3f} s ({} grid, {:.2f} samples/query, built if <= {})".format(
+            n_instances, n_points, extent, timings[0], timings[1], "skipped" if cache.skips else "built", timings[2],
+            "x".join(str(size) for size in shape), int(np.prod(shape)) / ((n_points - 1) * n_instances), cache.max_samples_per_query))
+
+def benchmark(n_points=100000, n_octaves=2, repeat=5):
+    import time
+    points = np.random.default_rng(0).uniform(-5.0, 5.0, size=(n_points, 3))
+    start = time.perf_counter()
+    for i in range(repeat):
+        turbulence_vector(points, n_octaves, amplitude_scale=1.0, frequency_scale=2.0)
+    elapsed = (time.perf_counter() - start) / repeat
+    print("turbulence_vector: {} points, {} octaves: {:.4f} s ({:.3f} us/point)".format(n_points, n_octaves, elapsed, elapsed / n_points * 1e6))
+    cache = NoiseVolumeCache(max_samples_per_query=None)
+    cache.get(points.min(axis=0), points.max(axis=0), n_octaves, amplitude_scale=1.0, frequency_scale=2.0)
+    start = time.perf_counter()
+    for i in range(repeat):
+        cache.turbulence_vector(points, points.min(axis=0), points.max(axis=0), n_octaves, amplitude_scale=1.0, frequency_scale=2.0)
+    elapsed = (time.perf_counter() - start) / repeat
+    print("NoiseVolumeCache.turbulence_vector: {} points, {} octaves: {:.4f} s ({:.3f} us/point)".format(n_points, n_octaves, elapsed, elapsed / n_points * 1e6))
+    benchmark_noise_cache()
+
+#
+# Script entry point.
+#
+if __name__ == "__main__":
+    benchmark()
+    for extent in (5.0, 10.0):
+        check_noise_cache(extent)
@@ -0,0 +1,121 @@
+# Author: Lovro Bosnar
+
+# Planning phase of procedural_3d_curve_from_drawing.py in pure NumPy.
+# All random choices of curve instances are drawn up front into one structured array (instance plan),
+# which Blender side only writes to scene. Plan can be saved, loaded and benchmarked without Blender.
+# Run as script for a small benchmark: python curve_draw_plan.py
+
+import json
+import os
+import numpy as np
+
+import curve_draw_random
+
+# Changed whenever same parameters would plan different rows, so plans saved by older code are not reused.
+PLAN_VERSION = 2
+
+# Instance plan row. thickness holds bevel depth after every thickening period.
+def instance_dtype(n_periods):
+    return np.dtype([
+        ("drawing", np.int32),
+        ("instance", np.int32),
+        ("seed", np.int64), # Perturbation noise seed.
+        ("offset", np.float32, (3,)),
+        ("emissive", np.bool_),
+        ("emission_intensity", np.float32),
+        ("color_index", np.int32),
+        ("bevel_depth", np.float32),
+        ("growth_start", np.float32),
+        ("growth_end", np.float32),
+        ("thickness", np.float32, (n_periods,)),
+        ("thickness_phase", np.float32), # Noise F-Modifier phase.
+        ("action_index", np.int32),
+        ("action_frame_offset", np.float32),
+        ("action_scale", np.float32),
+    ])
+
+# Frames of thickness keys: rest, start, then end of every period. Values are [bevel_depth, bevel_depth, *thickness].
+def thickening_frames(frame_start, frame_delta, n_periods, frame_rest=0):
+    return [frame_rest, frame_start] + [frame_start + (i + 1) * frame_delta for i in range(n_periods)]
+
+# Number of uniform random numbers drawn per instance.
+def n_instance_uniforms(n_periods):
+    return 13 + n_periods
+
+# Plan rows of given (drawing, instance) pairs. Every instance draws fixed number of uniforms from its own
+# stream (run_seed, drawing, instance, "instance"), so each row can be regenerated alone, in any order or process.
+# Same distributions as curve instances in main(). Returns structured array of instance_dtype(n_periods).
+def plan_instance_rows(run_seed, drawings, instances, n_colors, translation_rand_strength=10.0, chance_of_emissive_curves=0.1,
+        bevel_min=0.1, bevel_max=0.8, growth_start_min=0.01, growth_start_max=0.1, growth_end_min=0.7, growth_end_max=1.0,
+        n_periods=10, thickness_wobble=0.2, n_action_templates=8, action_max_frame_offset=30, action_scale_min=0.8, action_scale_max=1.2,
+        emission_intensity_min=10.0, emission_intensity_max=10.0):
+    drawings = np.asarray(drawings, dtype=np.int64).reshape(-1)
+    instances = np.asarray(instances, dtype=np.int64).reshape(-1)
+    n = len(drawings)
+    u = np.empty((n, n_instance_uniforms(n_periods)))
+    seeds = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        u[i] = curve_draw_random.stream(run_seed, drawings[i], instances[i], "instance").random(u.shape[1])
+        seeds[i] = curve_draw_random.stream_seed(run_seed, drawings[i], instances[i], "perturb")
+    plan = np.zeros(n, dtype=instance_dtype(n_periods))
+    plan["drawing"] = drawings
+    plan["instance"] = instances
+    plan["seed"] = seeds
+    plan["offset"] = (u[:, 0:3] - 0.5) * translation_rand_strength
+    plan["emissive"] = u[:, 3] < chance_of_emissive_curves
+    plan["color_index"] = np.minimum(u[:, 4] * max(n_colors, 1), max(n_colors, 1) - 1)
+    plan["bevel_depth"] = bevel_min + u[:, 5] * (bevel_max - bevel_min)
+    plan["growth_start"] = growth_start_min + u[:, 6] * (growth_start_max - growth_start_min)
+    plan["growth_end"] = growth_end_min + u[:, 7] * (growth_end_max - growth_end_min)
+    plan["thickness_phase"] = u[:, 8] * 1000.0
+    plan["action_index"] = np.minimum(u[:, 9] * max(n_action_templates, 1), max(n_action_templates, 1) - 1)
+    plan["action_frame_offset"] = -action_max_frame_offset + u[:, 10] * 2.0 * action_max_frame_offset
+    plan["action_scale"] = action_scale_min + u[:, 11] * (action_scale_max - action_scale_min)
+    # Every period thickness changes by factor in [1 - wobble, 1 + wobble] of previous thickness.
+    factors = 1.0 - thickness_wobble + u[:, 12:12 + n_periods] * 2.0 * thickness_wobble
+    plan["thickness"] = plan["bevel_depth"][:, np.newaxis] * np.cumprod(factors, axis=1)
+    # Numbers added later are appended after thickness, so earlier columns of a seed stay the same.
+    plan["emission_intensity"] = emission_intensity_min + u[:, 12 + n_periods] * (emission_intensity_max - emission_intensity_min)
+    return plan
+
+# Plan n_instances_per_drawing instances for each of n_drawings drawings (see plan_instance_rows).
+def plan_instances(run_seed, n_drawings, n_instances_per_drawing, n_colors, **kwargs):
+    drawings = np.repeat(np.arange(n_drawings), n_instances_per_drawing)
+    instances = np.tile(np.arange(n_instances_per_drawing), n_drawings)
+    return plan_instance_rows(run_seed, drawings, instances, n_colors, **kwargs)
+
+# Plan with plan_fn(run_seed, n_drawings, n_instances_per_drawing, n_colors, **kwargs) (e.g. plan_instances),
+# or load it from path if it was saved there with same parameters. New plan is saved to path (.npz with plan
+# and its parameters), replacing plan of other parameters, older version or older (.npy) format.
+def load_or_plan(path, plan_fn, run_seed, n_drawings, n_instances_per_drawing, n_colors, **kwargs):
+    metadata = json.loads(json.dumps(dict(kwargs, version=PLAN_VERSION, run_seed=run_seed, n_drawings=n_drawings,
+        n_instances_per_drawing=n_instances_per_drawing, n_colors=n_colors), sort_keys=True))
+    if path is not None and os.path.isfile(path):
+        saved = np.load(path)
+        if not isinstance(saved, np.lib.npyio.NpzFile) or "metadata" not in saved:
+            print("Instance plan {} is not in current format, planning again.".format(path))
+        else:
+            with saved:
+                if json.loads(str(saved["metadata"])) == metadata:
+                    return saved["plan"]
+            print("Instance plan {} has other parameters, planning again.".format(path))
+    plan = plan_fn(run_seed, n_drawings, n_instances_per_drawing, n_colors, **kwargs)
+    if path is not None:
+        # File object, so np.savez does not append .npz to path.
+        with open(path, "wb") as f:
+            np.savez(f, plan=plan, metadata=np.array(json.dumps(metadata, sort_keys=True)))
+    return plan
+
+def benchmark(n_drawings=10, n_instances_per_drawing=1000, repeat=5):
+    import time
+    start = time.perf_counter()
+    for i in range(repeat):
+        plan = plan_instances(i, n_drawings, n_instances_per_drawing, n_colors=n_instances_per_drawing)
+    elapsed = (time.perf_counter() - start) / repeat
+    print("plan_instances: {} instances, {} bytes: {:.4f} s ({:.3f} us/instance)".format(len(plan), plan.nbytes, elapsed, elapsed / len(plan) * 1e6))
+
+#
+# Script entry point.
+#
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,179 @@
+# Author: Lovro Bosnar
+
+# Pure computations of procedural_3d_curve_from_drawing.py (instance plan, curve perturbation, mball motion)
+# in pool of plain Python worker processes. Inputs and results are exchanged through shared memory
+# so only small task descriptions are pickled. Workers import only this module and NumPy helpers, never bpy.
+
+import contextlib
+import concurrent.futures
+import multiprocessing
+import multiprocessing.shared_memory
+import os
+import sys
+import numpy as np
+
+import curve_draw_noise
+import curve_draw_plan
+import curve_draw_sim
+
+# Array in shared memory block owned by creating process. spec is picklable handle for attach().
+class SharedArray:
+    def __init__(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        shape = tuple(np.atleast_1d(shape).tolist())
+        n_bytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        self.shm = multiprocessing.shared_memory.SharedMemory(create=True, size=n_bytes)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.spec = (self.shm.name, shape, dtype.descr if dtype.fields else dtype.str)
+
+    @classmethod
+    def from_array(cls, array):
+        array = np.ascontiguousarray(array)
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    # Copy of data, shared memory is released.
+    def release(self):
+        result = self.array.copy()
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+        return result
+
+# Attach to SharedArray by spec in worker. Returns (shared memory, array), close shared memory when done.
+def attach(spec):
+    name, shape, dtype = spec
+    shm = multiprocessing.shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+# Split range(n) into about n_chunks contiguous (start, stop) ranges.
+def chunk_ranges(n, n_chunks):
+    bounds = np.linspace(0, n, max(min(n_chunks, n), 1) + 1).astype(np.int64)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+#
+# Worker tasks. Every task writes its part of output array in place.
+#
+
+def _plan_task(out_spec, start, stop, run_seed, drawings, instances, n_colors, kwargs):
+    shm, out = attach(out_spec)
+    out[start:stop] = curve_draw_plan.plan_instance_rows(run_seed, drawings, instances, n_colors, **kwargs)
+    del out
+    shm.close()
+
+def _perturbation_task(co_spec, volume_spec, out_spec, start, stop, seeds, kwargs):
+    co_shm, co = attach(co_spec)
+    out_shm, out = attach(out_spec)
+    volume_shm, volume = attach(volume_spec) if volume_spec is not None else (None, None)
+    for i, seed in zip(range(start, stop), seeds):
+        out[i] = curve_draw_noise.curve_perturbation_offsets(co, seed=seed, noise_volume=volume, **kwargs)
+    del co, out, volume
+    co_shm.close()
+    out_shm.close()
+    if volume_shm is not None:
+        volume_shm.close()
+
+def _brownian_task(out_spec, start, stop, start_locations, n_steps, kwargs):
+    shm, out = attach(out_spec)
+    out[start:stop] = curve_draw_sim.simulate_brownian_motion(start_locations, n_steps, **kwargs)
+    del out
+    shm.close()
+
+def _flow_task(field_spec, out_spec, start, stop, start_locations, bb_min, bb_max, n_steps, kwargs):
+    field_shm, field = attach(field_spec)
+    out_shm, out = attach(out_spec)
+    out[start:stop] = curve_draw_sim.advect_in_flow_field(start_locations, field, bb_min, bb_max, n_steps, **kwargs)
+    del field, out
+    field_shm.close()
+    out_shm.close()
+
+# Spawned worker re-imports __main__ of parent from its file. Inside Blender that is script importing bpy,
+# so main module is hidden from multiprocessing while workers may be started (on submit).
+@contextlib.contextmanager
+def hidden_main_module():
+    main_module = sys.modules["__main__"]
+    main_file = main_module.__dict__.pop("__file__", None)
+    main_spec = getattr(main_module, "__spec__", None)
+    main_module.__spec__ = None
+    try:
+        yield
+    finally:
+        main_module.__spec__ = main_spec
+        if main_file is not None:
+            main_module.__file__ = main_file
+
+# Process pool of n_workers (all cores if None) spawned workers, with parallel versions of pure computations.
+# Each method splits work into chunks per worker, waits for all of them and returns result as normal array.
+class ComputePool:
+    def __init__(self, n_workers=None):
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.n_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def run(self, task, chunk_args):
+        with hidden_main_module():
+            futures = [self.executor.submit(task, *args) for args in chunk_args]
+        # Raise first worker error.
+        for future in futures:
+            future.result()
+
+    # Same as curve_draw_plan.plan_instances.
+    def plan_instances(self, run_seed, n_drawings, n_instances_per_drawing, n_colors, **kwargs):
+        drawings = np.repeat(np.arange(n_drawings), n_instances_per_drawing)
+        instances = np.tile(np.arange(n_instances_per_drawing), n_drawings)
+        out = SharedArray(len(drawings), curve_draw_plan.instance_dtype(kwargs.get("n_periods", 10)))
+        try:
+            self.run(_plan_task, [(out.spec, start, stop, run_seed, drawings[start:stop], instances[start:stop], n_colors, kwargs)
+                for start, stop in chunk_ranges(len(drawings), self.n_workers)])
+        finally:
+            plan = out.release()
+        return plan
+
+    # curve_draw_noise.curve_perturbation_offsets of same (N,3) points co for every seed. Returns (n_seeds, N, 3).
+    # With noise_cache its volume is built (or found) here and shared, so results equal in-process ones.
+    def perturbation_offsets(self, co, seeds, noise_cache=None, **kwargs):
+        co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+        volume = None
+        if noise_cache is not None and len(co) > 1:
+            volume_kwargs = {name: kwargs[name] for name in ("perturb_scale", "n_octaves", "amplitude_scale", "frequency_scale", "noise_seed") if name in kwargs}
+            volume = curve_draw_noise.curve_perturbation_volume(co, noise_cache, n_uses=len(seeds), **volume_kwargs)
+            # None if volume is not worth building, workers then evaluate noise directly as in process.
+            volume = SharedArray.from_array(volume) if volume is not None else None
+        co = SharedArray.from_array(co)
+        out = SharedArray((len(seeds), len(co.array), 3), np.float32)
+        try:
+            self.run(_perturbation_task, [(co.spec, volume.spec if volume is not None else None, out.spec, start, stop, list(seeds[start:stop]), kwargs)
+                for start, stop in chunk_ranges(len(seeds), self.n_workers)])
+        finally:
+            co.release()
+            if volume is not None:
+                volume.release()
+            offsets = out.release()
+        return offsets
+
+    # Same as curve_draw_sim.simulate_brownian_motion, balls move independently so they are split between workers.
+    def simulate_brownian_motion(self, start_locations, n_steps, **kwargs):
+        start_locations = np.asarray(start_locations, dtype=np.float64).reshape(-1, 3)
+        out = SharedArray((len(start_locations), n_steps + 1, 3), np.float64)
+        try:
+            self.run(_brownian_task, [(out.spec, start, stop, start_locations[start:stop], n_steps, kwargs)
+                for start, stop in chunk_ranges(len(start_locations), self.n_workers)])
+        finally:
+            trajectories = out.release()
+        return trajectories
+
+    # Same as curve_draw_sim.advect_in_flow_field, field is shared by all workers.
+    def advect_in_flow_field(self, start_locations, field, bb_min, bb_max, n_steps, **kwargs):
+        start_locations = np.asarray(start_locations, dtype=np.float64).reshape(-1, 3)
+        field = SharedArray.from_array(field)
+        out = SharedArray((len(start_locations), n_steps + 1, 3), np.float64)
+        try:
+            self.run(_flow_task, [(field.spec, out.spec, start, stop, start_locations[start:stop], bb_min, bb_max, n_steps, kwargs)
+                for start, stop in chunk_ranges(len(start_locations), self.n_workers)])
+        finally:
+            field.release()
+            trajectories = out.release()
+        return trajectories
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -0,0 +1,30 @@
+# Author: Lovro Bosnar
+
+# Deterministic random streams for procedural_3d_curve_from_drawing.py.
+# Every stream is keyed by path under run seed, e.g. (drawing, instance, purpose), and uses counter based
+# Philox generator, so any stream can be recreated identically in any process and in any order,
+# independently of how many numbers other streams used.
+
+import zlib
+import numpy as np
+
+# Path element as int: ints are kept, names (purposes) are hashed with stable CRC32.
+def path_key(element):
+    if isinstance(element, str):
+        return zlib.crc32(element.encode("utf-8"))
+    return int(element)
+
+def seed_sequence(run_seed, *path):
+    return np.random.SeedSequence(int(run_seed), spawn_key=tuple(path_key(element) for element in path))
+
+# Generator of stream at path under run_seed, e.g. stream(seed, drawing_idx, instance_idx, "instance").
+def stream(run_seed, *path):
+    return np.random.Generator(np.random.Philox(seed_sequence(run_seed, *path)))
+
+# Single 31 bit integer seed at path, for APIs which take integer seed (noise, geometry nodes).
+def stream_seed(run_seed, *path):
+    return int(seed_sequence(run_seed, *path).generate_state(1)[0] >> 1)
+
+# Fresh run seed from OS entropy, when run should not be reproduced.
+def random_run_seed():
+    return int(np.random.SeedSequence().generate_state(1)[0] >> 1)
@@ -0,0 +1,279 @@
+# Author: Lovro Bosnar
+
+# Pure NumPy metaball simulation for procedural_3d_curve_from_drawing.py.
+# Whole trajectories of all balls are computed as arrays and written to scene afterwards.
+
+import numpy as np
+
+import curve_draw_noise
+
+# Frames at which trajectory is recorded: 0 and every frame_step frames up to n_frames.
+def trajectory_frames(n_frames, frame_step=10):
+    return np.array([0] + list(range(frame_step, n_frames + 1, frame_step)), dtype=np.int64)
+
+# Noise driven random walk of all balls at once.
+# start_locations is (n_balls, 3). Every recorded step ball moves by noise_vector(location) * movement_intensity,
+# split into n_substeps smaller moves which each sample noise at current location.
+# Returns (n_balls, n_steps + 1, 3) trajectories, first step is start location.
+def simulate_brownian_motion(start_locations, n_steps, movement_intensity=5.0, n_substeps=1, noise_seed=0):
+    locations = np.array(start_locations, dtype=np.float64).reshape(-1, 3)
+    trajectories = np.empty((len(locations), n_steps + 1, 3))
+    trajectories[:, 0] = locations
+    substep_intensity = movement_intensity / n_substeps
+    for i_step in range(1, n_steps + 1):
+        for i_substep in range(n_substeps):
+            locations += curve_draw_noise.noise_vector(locations, seed=noise_seed) * substep_intensity
+        trajectories[:, i_step] = locations
+    return trajectories
+
+# Bits per axis of packed grid cell key.
+CELL_KEY_BITS = 21
+CELL_KEY_OFFSET = 1 << (CELL_KEY_BITS - 1)
+
+# Neighbour cell offsets including cell itself.
+NEIGHBOUR_OFFSETS = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+# Pack (N,3) integer cells into single int64 key per cell.
+def pack_cell_keys(cells):
+    cells = (cells + CELL_KEY_OFFSET) & ((1 << CELL_KEY_BITS) - 1)
+    return (cells[:, 0] << (2 * CELL_KEY_BITS)) | (cells[:, 1] << CELL_KEY_BITS) | cells[:, 2]
+
+# Pairs (i, j), i < j, of spheres which overlap: |p_i - p_j| < r_i + r_j.
+# Spheres are bucketed in uniform grid with cell size 2 * max radius, so only 27 neighbour cells
+# of each sphere are checked and cost is close to linear in number of spheres. Returns (n_pairs, 2).
+def find_colliding_pairs(locations, radii, cell_size=None):
+    locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+    radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(locations),))
+    n = len(locations)
+    if n < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    if cell_size is None:
+        cell_size = 2.0 * radii.max()
+    cells = np.floor(locations / cell_size).astype(np.int64)
+    keys = pack_cell_keys(cells)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    pairs = []
+    for offset in NEIGHBOUR_OFFSETS:
+        neighbour_keys = pack_cell_keys(cells + offset)
+        start = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        end = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+        counts = end - start
+        total = counts.sum()
+        if total == 0:
+            continue
+        i = np.repeat(np.arange(n), counts)
+        # Index of every candidate inside its neighbour cell range.
+        range_start = np.repeat(start, counts)
+        range_pos = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[range_start + range_pos]
+        candidates = i < j
+        i = i[candidates]
+        j = j[candidates]
+        dist_sq = ((locations[i] - locations[j]) ** 2).sum(axis=1)
+        hit = dist_sq < (radii[i] + radii[j]) ** 2
+        pairs.append(np.stack((i[hit], j[hit]), axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(pairs)
+
+# Colliding pairs at every recorded step of (n_balls, n_steps, 3) trajectories. Returns list of (n_pairs, 2).
+def find_trajectory_collisions(trajectories, radii, cell_size=None):
+    return [find_colliding_pairs(trajectories[:, i_step], radii, cell_size) for i_step in range(trajectories.shape[1])]
+
+# First step at which each ball collides with any other ball, -1 if it never does.
+def first_collision_steps(collisions, n_balls):
+    first_steps = np.full(n_balls, -1, dtype=np.int64)
+    for i_step, pairs in enumerate(collisions):
+        balls = pairs.ravel()
+        balls = balls[first_steps[balls] < 0]
+        first_steps[balls] = i_step
+    return first_steps
+
+# First recorded step at which each ball collides, checked at every substep of (n_balls, n_steps * n_substeps + 1, 3)
+# substep trajectories. Collision at any substep of step i (after step i - 1) is reported at step i, -1 if none.
+def first_substep_collision_steps(substep_trajectories, radii, n_substeps, cell_size=None):
+    first_substeps = first_collision_steps(find_trajectory_collisions(substep_trajectories, radii, cell_size), len(substep_trajectories))
+    return np.where(first_substeps < 0, -1, (first_substeps + n_substeps - 1) // n_substeps)
+
+# Uniform points in box [bb_min, bb_max] of local space, transformed by 4x4 matrix to world. Returns (n, 3).
+def sample_points_in_box(rng, n, bb_min, bb_max, matrix=None):
+    points = rng.uniform(bb_min, bb_max, size=(n, 3))
+    if matrix is None:
+        return points
+    matrix = np.asarray(matrix, dtype=np.float64)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+# Uniform points at distance [band_min, band_max] from random curve points (in random direction). Returns (n, 3).
+def sample_points_near_curve(rng, n, curve_points, band_min, band_max):
+    curve_points = np.asarray(curve_points, dtype=np.float64).reshape(-1, 3)
+    if len(curve_points) == 0:
+        raise ValueError("Cannot sample near curve without curve points.")
+    directions = rng.normal(size=(n, 3))
+    directions /= np.maximum(np.linalg.norm(directions, axis=1, keepdims=True), 1e-12)
+    # Uniform in volume of spherical shell.
+    distances = np.cbrt(rng.uniform(band_min ** 3, band_max ** 3, size=(n, 1)))
+    return curve_points[rng.integers(len(curve_points), size=n)] + directions * distances
+
+# Blue noise spheres by dart throwing with background grid: candidate is accepted only if it is
+# at least (r_i + r_j) * separation_scale away from every accepted sphere. Grid cell size is largest possible
+# separation, so only 27 neighbour cells are checked and cost is linear in n_spheres * max_attempts.
+# sample_candidates(k) returns (k, 3) candidate points. Sphere which finds no free place in max_attempts candidates
+# is dropped, so fewer than n_spheres may be returned. Returns (n, 3) locations and (n,) radii.
+def poisson_disk_sample(sample_candidates, radii, separation_scale=1.0, max_attempts=30):
+    radii = np.asarray(radii, dtype=np.float64)
+    if len(radii) == 0:
+        return np.empty((0, 3)), radii
+    cell_size = max(2.0 * radii.max() * separation_scale, 1e-6)
+    grid = {}
+    locations = []
+    kept_radii = []
+    for radius in radii:
+        for candidate in sample_candidates(max_attempts):
+            cell = tuple(np.floor(candidate / cell_size).astype(np.int64))
+            free = True
+            for offset in NEIGHBOUR_OFFSETS:
+                for j in grid.get((cell[0] + offset[0], cell[1] + offset[1], cell[2] + offset[2]), ()):
+                    separation = (radius + kept_radii[j]) * separation_scale
+                    if ((candidate - locations[j]) ** 2).sum() < separation * separation:
+                        free = False
+                        break
+                if not free:
+                    break
+            if free:
+                grid.setdefault(cell, []).append(len(locations))
+                locations.append(candidate)
+                kept_radii.append(radius)
+                break
+    return np.array(locations, dtype=np.float64).reshape(-1, 3), np.array(kept_radii, dtype=np.float64)
+
+# Divergence free noise: curl of noise_vector potential, by central differences. Returns (N,3).
+def curl_noise(points, scale=0.1, eps=1e-2, noise_seed=0):
+    p = np.asarray(points, dtype=np.float64).reshape(-1, 3) * scale
+    n = len(p)
+    # Potential at p +- eps along each axis in one noise evaluation: (2, 3 axes, N, 3 components).
+    offsets = np.concatenate((np.eye(3), -np.eye(3))) * eps
+    shifted = (p[np.newaxis, :, :] + offsets[:, np.newaxis, :]).reshape(-1, 3)
+    potential = curve_draw_noise.noise_vector(shifted, seed=noise_seed).reshape(2, 3, n, 3)
+    # d[axis][:, component] = d potential_component / d axis
+    d = (potential[0] - potential[1]) / (2.0 * eps)
+    return np.stack((
+        d[1][:, 2] - d[2][:, 1],
+        d[2][:, 0] - d[0][:, 2],
+        d[0][:, 1] - d[1][:, 0]), axis=1)
+
+# Regular grid over box: resolution samples along longest axis. Returns (rx,ry,rz,3) grid points.
+def grid_points(bb_min, bb_max, resolution):
+    bb_min = np.asarray(bb_min, dtype=np.float64)
+    bb_max = np.asarray(bb_max, dtype=np.float64)
+    extent = np.maximum(bb_max - bb_min, 1e-6)
+    shape = np.maximum(np.ceil(extent / extent.max() * (resolution - 1)).astype(np.int64) + 1, 2)
+    axes = [np.linspace(bb_min[i], bb_max[i], shape[i]) for i in range(3)]
+    return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+
+# Velocity at grid points from nearest curve point and its tangent:
+# flow along tangent and pull towards curve, both fading with distance, plus curl noise everywhere.
+# grid is (rx,ry,rz,3), nearest_points and nearest_tangents are per grid point. Returns (rx,ry,rz,3).
+def build_flow_field(grid, nearest_points, nearest_tangents, tangent_strength=1.0, attraction_strength=0.3, curl_strength=0.5, falloff=5.0, curl_scale=0.1, noise_seed=0):
+    shape = grid.shape
+    p = grid.reshape(-1, 3)
+    to_curve = np.asarray(nearest_points, dtype=np.float64).reshape(-1, 3) - p
+    dist = np.linalg.norm(to_curve, axis=1, keepdims=True)
+    weight = np.exp(-dist / falloff)
+    velocity = np.asarray(nearest_tangents, dtype=np.float64).reshape(-1, 3) * (tangent_strength * weight)
+    velocity += to_curve / np.maximum(dist, 1e-6) * (attraction_strength * (1.0 - weight))
+    velocity += curl_noise(p, curl_scale, noise_seed=noise_seed) * curl_strength
+    return velocity.reshape(shape)
+
+# Advect points through precomputed flow field built over [bb_min, bb_max] using trilinear lookups.
+# Returns (n_points, n_steps + 1, 3) trajectories.
+def advect_in_flow_field(start_locations, field, bb_min, bb_max, n_steps, movement_intensity=5.0, n_substeps=1):
+    locations = np.array(start_locations, dtype=np.float64).reshape(-1, 3)
+    trajectories = np.empty((len(locations), n_steps + 1, 3))
+    trajectories[:, 0] = locations
+    substep_intensity = movement_intensity / n_substeps
+    for i_step in range(1, n_steps + 1):
+        for i_substep in range(n_substeps):
+            locations += curve_draw_noise.sample_noise_volume(field, bb_min, bb_max, locations) * substep_intensity
+        trajectories[:, i_step] = locations
+    return trajectories
+
+# Ramer-Douglas-Peucker in time: keeps fewest samples such that linear interpolation in time between kept samples
+# is within tolerance of every sample. values is (n_frames, n_components). Returns sorted kept indices.
+def simplify_trajectory(frames, values, tolerance):
+    frames = np.asarray(frames, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(frames), -1)
+    if len(frames) <= 2:
+        return np.arange(len(frames))
+    keep = np.zeros(len(frames), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(frames) - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        t = (frames[a + 1:b] - frames[a]) / (frames[b] - frames[a])
+        interpolated = values[a] + t[:, np.newaxis] * (values[b] - values[a])
+        error = np.linalg.norm(values[a + 1:b] - interpolated, axis=1)
+        worst = np.argmax(error)
+        if error[worst] > tolerance:
+            split = a + 1 + worst
+            keep[split] = True
+            stack.append((a, split))
+            stack.append((split, b))
+    return np.nonzero(keep)[0]
+
+# Slopes (d value / d frame) at kept keys, estimated from all samples.
+def trajectory_slopes(frames, values, kept):
+    frames = np.asarray(frames, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(frames), -1)
+    if len(frames) < 2:
+        return np.zeros((len(kept), values.shape[1]))
+    return np.gradient(values, frames, axis=0)[kept]
+
+# Bezier handles of kept keys, placed a third of the way to neighbouring keys along slope,
+# as Blender F-Curve with FREE handles. Returns (n_kept, C) left and right handle frames and values.
+def bezier_handles(frames, values, kept, slopes):
+    frames = np.asarray(frames, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(frames), -1)
+    key_frames = frames[kept]
+    gaps = np.diff(key_frames)
+    left_gap = np.concatenate((gaps[:1], gaps)) / 3.0 if len(gaps) else np.ones(1)
+    right_gap = np.concatenate((gaps, gaps[-1:])) / 3.0 if len(gaps) else np.ones(1)
+    left = (key_frames - left_gap, values[kept] - slopes * left_gap[:, np.newaxis])
+    right = (key_frames + right_gap, values[kept] + slopes * right_gap[:, np.newaxis])
+    return left, right
+
+# Values of Bezier keys with bezier_handles at all frames (frames between first and last key).
+def evaluate_bezier_keys(frames, values, kept, slopes):
+    frames = np.asarray(frames, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(frames), -1)
+    key_frames = frames[kept]
+    key_values = values[kept]
+    segment = np.clip(np.searchsorted(key_frames, frames, side="right") - 1, 0, max(len(kept) - 2, 0))
+    if len(kept) < 2:
+        return np.repeat(key_values[:1], len(frames), axis=0)
+    f0 = key_frames[segment]
+    f1 = key_frames[segment + 1]
+    # Handles at thirds of segment make frame linear in Bezier parameter.
+    u = ((frames - f0) / (f1 - f0))[:, np.newaxis]
+    dt = (f1 - f0)[:, np.newaxis] / 3.0
+    p0 = key_values[segment]
+    p3 = key_values[segment + 1]
+    p1 = p0 + slopes[segment] * dt
+    p2 = p3 - slopes[segment + 1] * dt
+    return ((1 - u) ** 3) * p0 + 3 * ((1 - u) ** 2) * u * p1 + 3 * (1 - u) * (u ** 2) * p2 + (u ** 3) * p3
+
+# Fewest Bezier keys within positional tolerance: RDP, then handles fitted to trajectory slopes,
+# adding worst sample as key until Bezier curve is within tolerance too. Returns kept indices and slopes.
+def decimate_trajectory(frames, values, tolerance):
+    values = np.asarray(values, dtype=np.float64).reshape(len(frames), -1)
+    kept = simplify_trajectory(frames, values, tolerance)
+    while True:
+        slopes = trajectory_slopes(frames, values, kept)
+        error = np.linalg.norm(evaluate_bezier_keys(frames, values, kept, slopes) - values, axis=1)
+        error[kept] = 0.0
+        worst = np.argmax(error)
+        if error[worst] <= tolerance:
+            return kept, slopes
+        kept = np.sort(np.append(kept, worst))
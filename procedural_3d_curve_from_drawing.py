@@ -19,15 +19,35 @@
 #     + Emissive blur env, splines grow in mballs flow field - EEVEE multiple camera view - camera DOF, changing sharpness
 #     + close loop growth - EEVEE
 
+import os
+import sys
 import bpy
 import mathutils
+import mathutils.kdtree
 import bmesh
 import numpy as np
 
+# Helper modules live next to this script (and next to .blend when run from text editor).
+for script_dir in (os.path.dirname(os.path.abspath(__file__)), bpy.path.abspath("//")):
+    if script_dir and os.path.isdir(script_dir) and script_dir not in sys.path:
+        sys.path.append(script_dir)
+
+import curve_draw_noise
+import curve_draw_plan
+import curve_draw_pool
+import curve_draw_random
+import curve_draw_sim
+
 # Interpolate [a,b] using factor t.
 def lerp(t, a, b):
     return (1.0 - t) * a + t * b
 
+# Uniform random in [0,1): from numpy Generator rng (see curve_draw_random), or global mathutils.noise state if None.
+def random_value(rng=None):
+    if rng is None:
+        return mathutils.noise.random()
+    return rng.random()
+
 def create_collection_if_not_exists(collection_name):
     if collection_name not in bpy.data.collections:
         new_collection = bpy.data.collections.new(collection_name)
@@ -37,9 +57,11 @@ def add_object_to_collection(base_object, collection_name="collection"):
     create_collection_if_not_exists(collection_name)
     bpy.data.collections[collection_name].objects.link(base_object)
 
-def copy_obj(obj, collection_name):
+# With link_data=True copy shares obj.data instead of getting its own copy of it.
+def copy_obj(obj, collection_name, link_data=False):
     obj_cpy = obj.copy()
-    obj_cpy.data = obj.data.copy()
+    if not link_data:
+        obj_cpy.data = obj.data.copy()
     obj_cpy.animation_data_clear()
     if collection_name == None:
         bpy.context.collection.objects.link(obj_cpy)
@@ -47,31 +69,541 @@ def copy_obj(obj, collection_name):
         add_object_to_collection(obj_cpy, collection_name)
     return obj_cpy
 
-def perturb_curve_points(curve_obj, perturb_scale=1.0, perturb_strength=1.0, n_octaves=1, amplitude_scale=1.0, frequency_scale=1.0):
-    curve_type = curve_obj.data.splines[0].type
-    points = []
-    if curve_type == "BEZIER":
-        points = curve_obj.data.splines[0].bezier_points
-    if curve_type == "POLY" or curve_type == "NURBS":
-        points = curve_obj.data.splines[0].points
-    first_point = True
-    for point in points:
-        if first_point:
-            first_point = False
+# Read attribute of every item in bpy collection into (N, n_components) array with a single call.
+def foreach_get_array(collection, attr, n_components, dtype=np.float32):
+    arr = np.empty(len(collection) * n_components, dtype=dtype)
+    collection.foreach_get(attr, arr)
+    return arr.reshape(-1, n_components)
+
+# Write (N, n_components) array to attribute of every item in bpy collection with a single call.
+def foreach_set_array(collection, attr, arr, dtype=np.float32):
+    collection.foreach_set(attr, np.ascontiguousarray(arr, dtype=dtype).ravel())
+
+# Points of first spline and number of components of their co.
+# Note: POLY/NURBS points have 4th weight component: https://blender.stackexchange.com/questions/220812/what-is-the-4th-coordinate-of-spline-points
+def get_spline_points(curve_obj):
+    spline = curve_obj.data.splines[0]
+    if spline.type == "BEZIER":
+        return spline.bezier_points, 3
+    if spline.type == "POLY" or spline.type == "NURBS":
+        return spline.points, 4
+    return [], 3
+
+# Add input or output socket to node group and return its identifier (Blender 3.x and 4.x API).
+def new_node_group_socket(node_group, in_out, socket_type, name, default_value=None):
+    if hasattr(node_group, "interface"):
+        socket = node_group.interface.new_socket(name, in_out=in_out, socket_type=socket_type)
+    elif in_out == "INPUT":
+        socket = node_group.inputs.new(socket_type, name)
+    else:
+        socket = node_group.outputs.new(socket_type, name)
+    if default_value is not None:
+        socket.default_value = default_value
+    return socket.identifier
+
+def get_node_group_input_identifier(node_group, name):
+    if hasattr(node_group, "interface"):
+        return node_group.interface.items_tree[name].identifier
+    return node_group.inputs[name].identifier
+
+# Node group which gives linked curve instance its own perturbation, growth and bevel.
+# All inputs are per modifier, so instances sharing one curve datablock can still differ.
+def create_curve_instance_node_group(node_group_name="curve_instance_variation", n_octaves=2, amplitude_scale=1.0, profile_resolution=12):
+    node_group = bpy.data.node_groups.get(node_group_name)
+    if node_group is not None:
+        return node_group
+    node_group = bpy.data.node_groups.new(node_group_name, "GeometryNodeTree")
+    new_node_group_socket(node_group, "INPUT", "NodeSocketGeometry", "Geometry")
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Seed", 0.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Perturb Scale", 1.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Perturb Strength", 1.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Growth Start", 0.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Growth", 1.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Bevel Depth", 0.1)
+    new_node_group_socket(node_group, "OUTPUT", "NodeSocketGeometry", "Geometry")
+
+    nodes = node_group.nodes
+    links = node_group.links
+    group_input = nodes.new("NodeGroupInput")
+    group_input.location = (-1000, 0)
+    group_output = nodes.new("NodeGroupOutput")
+    group_output.location = (800, 0)
+
+    # Perturb every point except first one with noise, seed selects noise slice.
+    position = nodes.new("GeometryNodeInputPosition")
+    position.location = (-800, -200)
+    scale_position = nodes.new("ShaderNodeVectorMath")
+    scale_position.operation = "SCALE"
+    scale_position.location = (-600, -200)
+    links.new(position.outputs[0], scale_position.inputs[0])
+    links.new(group_input.outputs["Perturb Scale"], scale_position.inputs["Scale"])
+    noise = nodes.new("ShaderNodeTexNoise")
+    noise.noise_dimensions = "4D"
+    noise.location = (-400, -200)
+    noise.inputs["Scale"].default_value = 1.0
+    noise.inputs["Detail"].default_value = n_octaves - 1
+    noise.inputs["Roughness"].default_value = min(amplitude_scale, 1.0)
+    links.new(scale_position.outputs[0], noise.inputs["Vector"])
+    links.new(group_input.outputs["Seed"], noise.inputs["W"])
+    center_noise = nodes.new("ShaderNodeVectorMath")
+    center_noise.operation = "MULTIPLY_ADD"
+    center_noise.location = (-200, -200)
+    center_noise.inputs[1].default_value = (2.0, 2.0, 2.0)
+    center_noise.inputs[2].default_value = (-1.0, -1.0, -1.0)
+    links.new(noise.outputs["Color"], center_noise.inputs[0])
+    offset = nodes.new("ShaderNodeVectorMath")
+    offset.operation = "SCALE"
+    offset.location = (0, -200)
+    links.new(center_noise.outputs[0], offset.inputs[0])
+    links.new(group_input.outputs["Perturb Strength"], offset.inputs["Scale"])
+    index = nodes.new("GeometryNodeInputIndex")
+    index.location = (-200, -400)
+    not_first = nodes.new("FunctionNodeCompare")
+    not_first.data_type = "INT"
+    not_first.operation = "GREATER_THAN"
+    not_first.location = (0, -400)
+    links.new(index.outputs[0], not_first.inputs["A"])
+    not_first.inputs["B"].default_value = 0
+    set_position = nodes.new("GeometryNodeSetPosition")
+    set_position.location = (200, 0)
+    links.new(group_input.outputs["Geometry"], set_position.inputs["Geometry"])
+    links.new(not_first.outputs[0], set_position.inputs["Selection"])
+    links.new(offset.outputs[0], set_position.inputs["Offset"])
+
+    # Growth as trimmed curve, same as bevel factor start/end.
+    trim = nodes.new("GeometryNodeTrimCurve")
+    trim.mode = "FACTOR"
+    trim.location = (400, 0)
+    links.new(set_position.outputs[0], trim.inputs["Curve"])
+    links.new(group_input.outputs["Growth Start"], [socket for socket in trim.inputs if socket.name == "Start"][0])
+    links.new(group_input.outputs["Growth"], [socket for socket in trim.inputs if socket.name == "End"][0])
+
+    # Bevel as round profile.
+    profile = nodes.new("GeometryNodeCurvePrimitiveCircle")
+    profile.mode = "RADIUS"
+    profile.location = (400, -250)
+    profile.inputs["Resolution"].default_value = profile_resolution
+    links.new(group_input.outputs["Bevel Depth"], profile.inputs["Radius"])
+    curve_to_mesh = nodes.new("GeometryNodeCurveToMesh")
+    curve_to_mesh.location = (600, 0)
+    links.new(trim.outputs[0], curve_to_mesh.inputs["Curve"])
+    links.new(profile.outputs[0], curve_to_mesh.inputs["Profile Curve"])
+    shade_smooth = nodes.new("GeometryNodeSetShadeSmooth")
+    shade_smooth.location = (700, 0)
+    links.new(curve_to_mesh.outputs[0], shade_smooth.inputs["Geometry"])
+    links.new(shade_smooth.outputs[0], group_output.inputs[0])
+    return node_group
+
+# Name of modifier carrying per instance variation of linked curve instances.
+curve_instance_modifier_name = "curve_instance_variation"
+
+# Curve data property -> input of curve instance node group.
+curve_instance_inputs = {
+    "bevel_factor_start": "Growth Start",
+    "bevel_factor_end": "Growth",
+    "bevel_depth": "Bevel Depth",
+}
+
+def add_curve_instance_modifier(obj, node_group, seed, perturb_scale=1.0, perturb_strength=1.0):
+    mod = obj.modifiers.new(curve_instance_modifier_name, "NODES")
+    mod.node_group = node_group
+    mod[get_node_group_input_identifier(node_group, "Seed")] = seed
+    mod[get_node_group_input_identifier(node_group, "Perturb Scale")] = perturb_scale
+    mod[get_node_group_input_identifier(node_group, "Perturb Strength")] = perturb_strength
+    return mod
+
+# Give object its own material while its data (and its material slots) may be shared.
+# Empty slot is added to obj.data if it has none, so data should not be shared with source objects.
+def set_object_material(obj, mat):
+    if len(obj.material_slots) == 0:
+        obj.data.materials.append(None)
+    obj.material_slots[0].link = "OBJECT"
+    obj.material_slots[0].material = mat
+
+# ID and RNA path of curve property of instance: curve data for copied instances,
+# modifier input for linked instances.
+def get_instance_property_target(curve, prop):
+    mod = curve.modifiers.get(curve_instance_modifier_name)
+    if mod is None:
+        return curve.data, prop
+    identifier = get_node_group_input_identifier(mod.node_group, curve_instance_inputs[prop])
+    return curve, 'modifiers["{}"]["{}"]'.format(mod.name, identifier)
+
+def set_instance_property(curve, prop, value):
+    mod = curve.modifiers.get(curve_instance_modifier_name)
+    if mod is None:
+        setattr(curve.data, prop, value)
+    else:
+        mod[get_node_group_input_identifier(mod.node_group, curve_instance_inputs[prop])] = value
+
+# Nodes with typed variants (Random Value, Switch, Store Named Attribute) have several sockets
+# with the same name, only the one matching node's data type is enabled.
+def get_node_socket(sockets, name):
+    for socket in sockets:
+        if socket.name == name and socket.enabled:
+            return socket
+    return sockets[name]
+
+def new_math_node(node_group, operation, location, a=None, b=None):
+    node = node_group.nodes.new("ShaderNodeMath")
+    node.operation = operation
+    node.location = location
+    for i, value in enumerate((a, b)):
+        if value is None:
             continue
-        point_co = mathutils.Vector((point.co[0], point.co[1], point.co[2]))       
-        trans_vec = mathutils.noise.turbulence_vector(
-            point_co * perturb_scale * mathutils.noise.random(), 
-            n_octaves,
-            False, #hard
-            noise_basis='PERLIN_ORIGINAL',
-            amplitude_scale=amplitude_scale,
-            frequency_scale=frequency_scale) * perturb_strength
-        new_point_co = point_co + trans_vec
-        if curve_type == "BEZIER":
-            point.co = (new_point_co[0], new_point_co[1], new_point_co[2])
-        if curve_type == "POLY" or curve_type == "NURBS":
-            point.co = (new_point_co[0], new_point_co[1], new_point_co[2], point.co[3]) # Note: https://blender.stackexchange.com/questions/220812/what-is-the-4th-coordinate-of-spline-points
+        if isinstance(value, bpy.types.NodeSocket):
+            node_group.links.new(value, node.inputs[i])
+        else:
+            node.inputs[i].default_value = value
+    return node
+
+def new_random_value_node(node_group, data_type, location, instance_id, seed_offset, seed, min_value=None, max_value=None, probability=None):
+    links = node_group.links
+    node = node_group.nodes.new("FunctionNodeRandomValue")
+    node.data_type = data_type
+    node.location = location
+    links.new(instance_id, get_node_socket(node.inputs, "ID"))
+    seed_sum = new_math_node(node_group, "ADD", (location[0] - 200, location[1] - 150), seed, seed_offset)
+    links.new(seed_sum.outputs[0], get_node_socket(node.inputs, "Seed"))
+    for name, value in (("Min", min_value), ("Max", max_value), ("Probability", probability)):
+        if value is None:
+            continue
+        if isinstance(value, bpy.types.NodeSocket):
+            links.new(value, get_node_socket(node.inputs, name))
+        else:
+            get_node_socket(node.inputs, name).default_value = value
+    return node
+
+# Node group which generates all instances of one drawing as single geometry:
+# instances drawing on random points, perturbs, trims (growth) and bevels every instance
+# using per instance random values and stores per instance color for attribute material.
+def create_drawing_instances_node_group(node_group_name="drawing_instances", n_octaves=2, amplitude_scale=1.0, profile_resolution=12):
+    node_group = bpy.data.node_groups.get(node_group_name)
+    if node_group is not None:
+        return node_group
+    node_group = bpy.data.node_groups.new(node_group_name, "GeometryNodeTree")
+    new_node_group_socket(node_group, "INPUT", "NodeSocketGeometry", "Geometry")
+    new_node_group_socket(node_group, "INPUT", "NodeSocketObject", "Drawing")
+    new_node_group_socket(node_group, "INPUT", "NodeSocketMaterial", "Material")
+    new_node_group_socket(node_group, "INPUT", "NodeSocketInt", "Count", 50)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketInt", "Seed", 0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Translation Strength", 10.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Perturb Scale", 1.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Perturb Strength", 1.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Hue", 0.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Emissive Chance", 0.1)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Emission Strength Min", 10.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Emission Strength Max", 10.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketBool", "Emissive Palette Colors", False)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Bevel Min", 0.1)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Bevel Max", 0.8)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Thickness Wobble", 0.2)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Thickness Period", 30.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Growth Start Min", 0.01)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Growth Start Max", 0.1)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Growth End Min", 0.7)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Growth End Max", 1.0)
+    new_node_group_socket(node_group, "INPUT", "NodeSocketFloat", "Frame End", 300.0)
+    new_node_group_socket(node_group, "OUTPUT", "NodeSocketGeometry", "Geometry")
+
+    nodes = node_group.nodes
+    links = node_group.links
+    group_input = nodes.new("NodeGroupInput")
+    group_input.location = (-2000, 0)
+    group_output = nodes.new("NodeGroupOutput")
+    group_output.location = (1800, 0)
+    seed = group_input.outputs["Seed"]
+
+    # One point per instance at random offset, point index is instance id.
+    index = nodes.new("GeometryNodeInputIndex")
+    index.location = (-1800, -400)
+    translation_half = new_math_node(node_group, "MULTIPLY", (-1800, -600), group_input.outputs["Translation Strength"], 0.5)
+    translation_min = new_math_node(node_group, "MULTIPLY", (-1600, -600), translation_half.outputs[0], -1.0)
+    offsets = new_random_value_node(node_group, "FLOAT_VECTOR", (-1400, -400), index.outputs[0], 0, seed)
+    combine_min = nodes.new("ShaderNodeCombineXYZ")
+    combine_min.location = (-1600, -800)
+    combine_max = nodes.new("ShaderNodeCombineXYZ")
+    combine_max.location = (-1600, -1000)
+    for i in range(3):
+        links.new(translation_min.outputs[0], combine_min.inputs[i])
+        links.new(translation_half.outputs[0], combine_max.inputs[i])
+    links.new(combine_min.outputs[0], get_node_socket(offsets.inputs, "Min"))
+    links.new(combine_max.outputs[0], get_node_socket(offsets.inputs, "Max"))
+    points = nodes.new("GeometryNodePoints")
+    points.location = (-1200, -200)
+    links.new(group_input.outputs["Count"], points.inputs["Count"])
+    links.new(get_node_socket(offsets.outputs, "Value"), points.inputs["Position"])
+    store_id = nodes.new("GeometryNodeStoreNamedAttribute")
+    store_id.data_type = "INT"
+    store_id.domain = "POINT"
+    store_id.location = (-1000, -200)
+    store_id.inputs["Name"].default_value = "instance_id"
+    links.new(points.outputs[0], store_id.inputs["Geometry"])
+    links.new(index.outputs[0], get_node_socket(store_id.inputs, "Value"))
+
+    # Instance drawing on points and make instances real curves.
+    drawing_info = nodes.new("GeometryNodeObjectInfo")
+    drawing_info.transform_space = "RELATIVE"
+    drawing_info.location = (-1000, 0)
+    links.new(group_input.outputs["Drawing"], drawing_info.inputs["Object"])
+    instance_on_points = nodes.new("GeometryNodeInstanceOnPoints")
+    instance_on_points.location = (-800, 0)
+    links.new(store_id.outputs[0], instance_on_points.inputs["Points"])
+    links.new(drawing_info.outputs["Geometry"], instance_on_points.inputs["Instance"])
+    realize = nodes.new("GeometryNodeRealizeInstances")
+    realize.location = (-600, 0)
+    links.new(instance_on_points.outputs[0], realize.inputs[0])
+    instance_id = nodes.new("GeometryNodeInputNamedAttribute")
+    instance_id.data_type = "INT"
+    instance_id.location = (-800, -1200)
+    instance_id.inputs["Name"].default_value = "instance_id"
+    instance_id = get_node_socket(instance_id.outputs, "Attribute")
+
+    # Perturb every point except first one of each spline, instance id selects noise slice.
+    position = nodes.new("GeometryNodeInputPosition")
+    position.location = (-800, -300)
+    scale_position = nodes.new("ShaderNodeVectorMath")
+    scale_position.operation = "SCALE"
+    scale_position.location = (-600, -300)
+    links.new(position.outputs[0], scale_position.inputs[0])
+    links.new(group_input.outputs["Perturb Scale"], scale_position.inputs["Scale"])
+    noise_w = new_math_node(node_group, "MULTIPLY_ADD", (-600, -500), instance_id, 1.618)
+    links.new(seed, noise_w.inputs[2])
+    noise = nodes.new("ShaderNodeTexNoise")
+    noise.noise_dimensions = "4D"
+    noise.location = (-400, -300)
+    noise.inputs["Scale"].default_value = 1.0
+    noise.inputs["Detail"].default_value = n_octaves - 1
+    noise.inputs["Roughness"].default_value = min(amplitude_scale, 1.0)
+    links.new(scale_position.outputs[0], noise.inputs["Vector"])
+    links.new(noise_w.outputs[0], noise.inputs["W"])
+    center_noise = nodes.new("ShaderNodeVectorMath")
+    center_noise.operation = "MULTIPLY_ADD"
+    center_noise.location = (-200, -300)
+    center_noise.inputs[1].default_value = (2.0, 2.0, 2.0)
+    center_noise.inputs[2].default_value = (-1.0, -1.0, -1.0)
+    links.new(noise.outputs["Color"], center_noise.inputs[0])
+    offset = nodes.new("ShaderNodeVectorMath")
+    offset.operation = "SCALE"
+    offset.location = (0, -300)
+    links.new(center_noise.outputs[0], offset.inputs[0])
+    links.new(group_input.outputs["Perturb Strength"], offset.inputs["Scale"])
+    first_point = nodes.new("GeometryNodeCurveEndpointSelection")
+    first_point.location = (-200, -500)
+    first_point.inputs["Start Size"].default_value = 1
+    first_point.inputs["End Size"].default_value = 0
+    not_first = nodes.new("FunctionNodeBooleanMath")
+    not_first.operation = "NOT"
+    not_first.location = (0, -500)
+    links.new(first_point.outputs[0], not_first.inputs[0])
+    set_position = nodes.new("GeometryNodeSetPosition")
+    set_position.location = (200, 0)
+    links.new(realize.outputs[0], set_position.inputs["Geometry"])
+    links.new(not_first.outputs[0], set_position.inputs["Selection"])
+    links.new(offset.outputs[0], set_position.inputs["Offset"])
+
+    # Bevel: random depth per instance, wobbling in time around it.
+    bevel = new_random_value_node(node_group, "FLOAT", (0, -800), instance_id, 1, seed, group_input.outputs["Bevel Min"], group_input.outputs["Bevel Max"])
+    scene_time = nodes.new("GeometryNodeInputSceneTime")
+    scene_time.location = (-600, -1000)
+    wobble_time = new_math_node(node_group, "DIVIDE", (-400, -1000), scene_time.outputs["Frame"], group_input.outputs["Thickness Period"])
+    wobble_w = new_math_node(node_group, "MULTIPLY_ADD", (-200, -1000), instance_id, 7.31)
+    links.new(wobble_time.outputs[0], wobble_w.inputs[2])
+    wobble_noise = nodes.new("ShaderNodeTexNoise")
+    wobble_noise.noise_dimensions = "1D"
+    wobble_noise.location = (0, -1000)
+    links.new(wobble_w.outputs[0], wobble_noise.inputs["W"])
+    wobble_min = new_math_node(node_group, "SUBTRACT", (0, -1200), 1.0, group_input.outputs["Thickness Wobble"])
+    wobble_max = new_math_node(node_group, "ADD", (0, -1400), 1.0, group_input.outputs["Thickness Wobble"])
+    wobble = nodes.new("ShaderNodeMapRange")
+    wobble.location = (200, -1000)
+    links.new(wobble_noise.outputs["Fac"], wobble.inputs["Value"])
+    wobble.inputs["From Min"].default_value = 0.3
+    wobble.inputs["From Max"].default_value = 0.7
+    links.new(wobble_min.outputs[0], wobble.inputs["To Min"])
+    links.new(wobble_max.outputs[0], wobble.inputs["To Max"])
+    radius = nodes.new("GeometryNodeInputRadius")
+    radius.location = (200, -600)
+    bevel_radius = new_math_node(node_group, "MULTIPLY", (400, -700), get_node_socket(bevel.outputs, "Value"), wobble.outputs[0])
+    drawing_radius = new_math_node(node_group, "MULTIPLY", (600, -600), radius.outputs[0], bevel_radius.outputs[0])
+    set_radius = nodes.new("GeometryNodeSetCurveRadius")
+    set_radius.location = (600, 0)
+    links.new(set_position.outputs[0], set_radius.inputs["Curve"])
+    links.new(drawing_radius.outputs[0], set_radius.inputs["Radius"])
+
+    # Growth: trim end goes from random start to random end growth with cubic ease out.
+    growth_start = new_random_value_node(node_group, "FLOAT", (400, -1200), instance_id, 2, seed, group_input.outputs["Growth Start Min"], group_input.outputs["Growth Start Max"])
+    growth_end = new_random_value_node(node_group, "FLOAT", (400, -1400), instance_id, 3, seed, group_input.outputs["Growth End Min"], group_input.outputs["Growth End Max"])
+    time_factor = new_math_node(node_group, "DIVIDE", (400, -1600), scene_time.outputs["Frame"], group_input.outputs["Frame End"])
+    time_factor.use_clamp = True
+    time_left = new_math_node(node_group, "SUBTRACT", (600, -1600), 1.0, time_factor.outputs[0])
+    time_left_cubed = new_math_node(node_group, "POWER", (800, -1600), time_left.outputs[0], 3.0)
+    ease_out = new_math_node(node_group, "SUBTRACT", (1000, -1600), 1.0, time_left_cubed.outputs[0])
+    growth = nodes.new("ShaderNodeMapRange")
+    growth.location = (1000, -1200)
+    links.new(ease_out.outputs[0], growth.inputs["Value"])
+    links.new(get_node_socket(growth_start.outputs, "Value"), growth.inputs["To Min"])
+    links.new(get_node_socket(growth_end.outputs, "Value"), growth.inputs["To Max"])
+    trim = nodes.new("GeometryNodeTrimCurve")
+    trim.mode = "FACTOR"
+    trim.location = (800, 0)
+    links.new(set_radius.outputs[0], trim.inputs["Curve"])
+    links.new(growth.outputs[0], get_node_socket(trim.inputs, "End"))
+
+    # Per instance color: palette hue with random saturation and value, some instances emissive
+    # (white, or palette color with Emissive Palette Colors) with random strength.
+    saturation = new_random_value_node(node_group, "FLOAT", (600, -1900), instance_id, 4, seed, 0.0, 1.0)
+    value = new_random_value_node(node_group, "FLOAT", (600, -2100), instance_id, 5, seed, 0.0, 1.0)
+    hsv = nodes.new("FunctionNodeCombineColor")
+    hsv.mode = "HSV"
+    hsv.location = (800, -1900)
+    links.new(group_input.outputs["Hue"], hsv.inputs[0])
+    links.new(get_node_socket(saturation.outputs, "Value"), hsv.inputs[1])
+    links.new(get_node_socket(value.outputs, "Value"), hsv.inputs[2])
+    emissive = new_random_value_node(node_group, "BOOLEAN", (600, -2300), instance_id, 6, seed, probability=group_input.outputs["Emissive Chance"])
+    emissive = get_node_socket(emissive.outputs, "Value")
+    emissive_color = nodes.new("GeometryNodeSwitch")
+    emissive_color.input_type = "RGBA"
+    emissive_color.location = (800, -2100)
+    links.new(group_input.outputs["Emissive Palette Colors"], get_node_socket(emissive_color.inputs, "Switch"))
+    get_node_socket(emissive_color.inputs, "False").default_value = (1.0, 1.0, 1.0, 1.0)
+    links.new(hsv.outputs[0], get_node_socket(emissive_color.inputs, "True"))
+    color = nodes.new("GeometryNodeSwitch")
+    color.input_type = "RGBA"
+    color.location = (1000, -1900)
+    links.new(emissive, get_node_socket(color.inputs, "Switch"))
+    links.new(hsv.outputs[0], get_node_socket(color.inputs, "False"))
+    links.new(get_node_socket(emissive_color.outputs, "Output"), get_node_socket(color.inputs, "True"))
+    emission_strength = new_random_value_node(node_group, "FLOAT", (800, -2500), instance_id, 7, seed, group_input.outputs["Emission Strength Min"], group_input.outputs["Emission Strength Max"])
+    emission = new_math_node(node_group, "MULTIPLY", (1000, -2300), emissive, get_node_socket(emission_strength.outputs, "Value"))
+    store_color = nodes.new("GeometryNodeStoreNamedAttribute")
+    store_color.data_type = "FLOAT_COLOR"
+    store_color.domain = "CURVE"
+    store_color.location = (1000, 0)
+    store_color.inputs["Name"].default_value = "instance_color"
+    links.new(trim.outputs[0], store_color.inputs["Geometry"])
+    links.new(get_node_socket(color.outputs, "Output"), get_node_socket(store_color.inputs, "Value"))
+    store_emission = nodes.new("GeometryNodeStoreNamedAttribute")
+    store_emission.data_type = "FLOAT"
+    store_emission.domain = "CURVE"
+    store_emission.location = (1200, 0)
+    store_emission.inputs["Name"].default_value = "instance_emission"
+    links.new(store_color.outputs[0], store_emission.inputs["Geometry"])
+    links.new(emission.outputs[0], get_node_socket(store_emission.inputs, "Value"))
+
+    # Bevel as round profile scaled by curve radius.
+    profile = nodes.new("GeometryNodeCurvePrimitiveCircle")
+    profile.mode = "RADIUS"
+    profile.location = (1200, -250)
+    profile.inputs["Resolution"].default_value = profile_resolution
+    profile.inputs["Radius"].default_value = 1.0
+    curve_to_mesh = nodes.new("GeometryNodeCurveToMesh")
+    curve_to_mesh.location = (1400, 0)
+    links.new(store_emission.outputs[0], curve_to_mesh.inputs["Curve"])
+    links.new(profile.outputs[0], curve_to_mesh.inputs["Profile Curve"])
+    shade_smooth = nodes.new("GeometryNodeSetShadeSmooth")
+    shade_smooth.location = (1500, 0)
+    links.new(curve_to_mesh.outputs[0], shade_smooth.inputs["Geometry"])
+    set_material = nodes.new("GeometryNodeSetMaterial")
+    set_material.location = (1600, 0)
+    links.new(shade_smooth.outputs[0], set_material.inputs["Geometry"])
+    links.new(group_input.outputs["Material"], set_material.inputs["Material"])
+    links.new(set_material.outputs[0], group_output.inputs[0])
+    return node_group
+
+# Material reading color and emission strength from attributes: diffuse, or emission where strength > 0.
+# attribute_type is "GEOMETRY" for attributes on geometry, "OBJECT" or "INSTANCER" for custom properties.
+def create_attribute_material(mat_id, attribute_type="GEOMETRY", color_attribute="instance_color", emission_attribute="instance_emission"):
+    mat = bpy.data.materials.get(mat_id)
+    if mat is not None:
+        return mat
+    mat = bpy.data.materials.new(name=mat_id)
+    mat.use_nodes = True
+    nodes = mat.node_tree.nodes
+    links = mat.node_tree.links
+    links.clear()
+    nodes.clear()
+    output = nodes.new(type='ShaderNodeOutputMaterial')
+    output.location = (600, 0)
+    color = nodes.new(type='ShaderNodeAttribute')
+    color.attribute_type = attribute_type
+    color.attribute_name = color_attribute
+    color.location = (-400, 100)
+    strength = nodes.new(type='ShaderNodeAttribute')
+    strength.attribute_type = attribute_type
+    strength.attribute_name = emission_attribute
+    strength.location = (-400, -200)
+    diffuse = nodes.new(type='ShaderNodeBsdfDiffuse')
+    diffuse.location = (0, 200)
+    links.new(color.outputs["Color"], diffuse.inputs[0])
+    emission = nodes.new(type='ShaderNodeEmission')
+    emission.location = (0, 0)
+    links.new(color.outputs["Color"], emission.inputs[0])
+    links.new(strength.outputs["Fac"], emission.inputs[1])
+    is_emissive = nodes.new(type='ShaderNodeMath')
+    is_emissive.operation = "GREATER_THAN"
+    is_emissive.location = (0, -200)
+    links.new(strength.outputs["Fac"], is_emissive.inputs[0])
+    is_emissive.inputs[1].default_value = 0.0
+    mix = nodes.new(type='ShaderNodeMixShader')
+    mix.location = (300, 0)
+    links.new(is_emissive.outputs[0], mix.inputs[0])
+    links.new(diffuse.outputs[0], mix.inputs[1])
+    links.new(emission.outputs[0], mix.inputs[2])
+    links.new(mix.outputs[0], output.inputs[0])
+    return mat
+
+# Single object generating all instances of drawing with geometry nodes.
+def create_drawing_instances_object(curve_drawing, node_group, mat, collection_name, n_instances, seed, hue, translation_rand_strength=10.0, chance_of_emissive_curves=0.1, emission_intensity_min=10.0, emission_intensity_max=10.0,
+        emissive_palette_colors=False, bevel_min=0.1, bevel_max=0.8, n_frames=300, bevel_thickening_period=10):
+    mesh = bpy.data.meshes.new(curve_drawing.name + "_instances")
+    obj = bpy.data.objects.new(curve_drawing.name + "_instances", mesh)
+    add_object_to_collection(obj, collection_name)
+    mod = obj.modifiers.new("drawing_instances", "NODES")
+    mod.node_group = node_group
+    inputs = {
+        "Drawing": curve_drawing,
+        "Material": mat,
+        "Count": n_instances,
+        "Seed": seed,
+        "Translation Strength": translation_rand_strength,
+        "Hue": hue,
+        "Emissive Chance": chance_of_emissive_curves,
+        "Emission Strength Min": emission_intensity_min,
+        "Emission Strength Max": emission_intensity_max,
+        "Emissive Palette Colors": emissive_palette_colors,
+        "Bevel Min": bevel_min,
+        "Bevel Max": bevel_max,
+        "Thickness Period": n_frames / bevel_thickening_period,
+        "Frame End": n_frames,
+    }
+    for name, value in inputs.items():
+        mod[get_node_group_input_identifier(node_group, name)] = value
+    return obj
+
+# Displace curve points (and Bezier handles) by noise, see curve_draw_noise.curve_perturbation_offsets.
+# offsets are precomputed (n_points, 3) displacements, e.g. from curve_draw_pool.ComputePool.
+# noise_cache_uses is number of curves with same points expected to be perturbed (see NoiseVolumeCache).
+def perturb_curve_points(curve_obj, perturb_scale=1.0, perturb_strength=1.0, n_octaves=1, amplitude_scale=1.0, frequency_scale=1.0, seed=None, noise_seed=0, noise_cache=None, offsets=None, noise_cache_uses=1):
+    points, n_components = get_spline_points(curve_obj)
+    if len(points) < 2:
+        return curve_obj
+    # Read all points at once. First point stays in place.
+    co = foreach_get_array(points, "co", n_components)
+    if offsets is not None:
+        trans_vecs = np.asarray(offsets, dtype=np.float32)
+    else:
+        trans_vecs = curve_draw_noise.curve_perturbation_offsets(co[:, :3], perturb_scale, perturb_strength, n_octaves, amplitude_scale, frequency_scale,
+            seed=(seed if seed is not None else int(mathutils.noise.random() * 2**31)), noise_seed=noise_seed, noise_cache=noise_cache, noise_cache_uses=noise_cache_uses)
+    # Displace xyz only, weight of POLY/NURBS points is kept.
+    co[:, :3] += trans_vecs
+    foreach_set_array(points, "co", co)
+    # Bezier handles move together with their control point.
+    if n_components == 3:
+        for handle in ("handle_left", "handle_right"):
+            handle_co = foreach_get_array(points, handle, 3)
+            foreach_set_array(points, handle, handle_co + trans_vecs)
+    curve_obj.data.update_tag()
     return curve_obj
 
 def create_material(mat_id, mat_type, color=mathutils.Color((1.0, 0.5, 0.1))):
@@ -109,36 +641,204 @@ def create_material(mat_id, mat_type, color=mathutils.Color((1.0, 0.5, 0.1))):
 
     return mat
 
-def animate_curve_growth(curve, frame_start, frame_end, growth_factor_end, start_growth):
-    curve.data.bevel_factor_end = start_growth
-    curve.data.bevel_factor_start = 0
-    curve.data.keyframe_insert(data_path="bevel_factor_end", frame=frame_start)
-    curve.data.keyframe_insert(data_path="bevel_factor_end", frame=frame_start)
-    curve.data.bevel_factor_end = growth_factor_end
-    curve.data.keyframe_insert(data_path="bevel_factor_end", frame=frame_end)
-
-def animate_curve_thickness(curve, frame_start, frame_end, thickness_min, thickness_max, start_thickness=0.0):
-    curve.data.bevel_depth = start_thickness
-    curve.data.keyframe_insert(data_path="bevel_depth", frame=frame_start)
-    curve.data.bevel_depth = lerp(mathutils.noise.random(), thickness_min, thickness_max)
-    curve.data.keyframe_insert(data_path="bevel_depth", frame=frame_end)
-
-# https://behreajj.medium.com/scripting-curves-in-blender-with-python-c487097efd13
-def set_animation_fcurve(base_object, option='BOUNCE'):
-    fcurves = base_object.data.animation_data.action.fcurves
-    for fcurve in fcurves:
-        for kf in fcurve.keyframe_points:
-            # Options: ['CONSTANT', 'LINEAR', 'BEZIER', 'SINE',
-            # 'QUAD', 'CUBIC', 'QUART', 'QUINT', 'EXPO', 'CIRC',
-            # 'BACK', 'BOUNCE', 'ELASTIC']
-            kf.interpolation = option
-            # Options: ['AUTO', 'EASE_IN', 'EASE_OUT', 'EASE_IN_OUT']
-            kf.easing = 'EASE_OUT'
+# Materials shared between objects whose shader type and quantized color match.
+# Once pool holds max_size materials, closest existing material of same type is reused.
+class MaterialPool:
+    def __init__(self, quantization=1.0/32.0, max_size=64, name_prefix="pool"):
+        self.quantization = quantization
+        self.max_size = max_size
+        self.name_prefix = name_prefix
+        self.materials = {}
+
+    def get(self, mat_type, color, obj=None):
+        key = (mat_type,) + tuple(int(round(c / self.quantization)) for c in color[:])
+        mat = self.materials.get(key)
+        if mat is not None:
+            return mat
+        if len(self.materials) >= self.max_size:
+            same_type_keys = [k for k in self.materials if k[0] == mat_type]
+            if same_type_keys:
+                nearest_key = min(same_type_keys, key=lambda k: sum((a - b) ** 2 for a, b in zip(k[1:], key[1:])))
+                return self.materials[nearest_key]
+        quantized_color = mathutils.Color(tuple(k * self.quantization for k in key[1:]))
+        mat_id = "{}_{}_{}".format(self.name_prefix, mat_type, "_".join(str(k) for k in key[1:]))
+        mat = create_material(mat_id, mat_type, quantized_color)
+        self.materials[key] = mat
+        return mat
+
+# One attribute material (see create_attribute_material) for all diffuse and emission objects.
+# Color is stored as custom property of each object, emission strength property is 1 for emission
+# (intensity is in color, as for other materials) and 0 for diffuse.
+class AttributeMaterialPool:
+    def __init__(self, name_prefix="instance_attribute"):
+        self.name_prefix = name_prefix
+        self.material = None
+
+    def get(self, mat_type, color, obj=None):
+        if mat_type not in ("diffuse", "emission"):
+            raise ValueError("Attribute materials are diffuse or emission, not {}".format(mat_type))
+        if obj is not None:
+            obj["instance_color"] = tuple(color[:])
+            obj["instance_emission"] = 1.0 if mat_type == "emission" else 0.0
+        if self.material is None:
+            self.material = create_attribute_material(self.name_prefix, attribute_type="OBJECT")
+        return self.material
+
+# Material from pool if given, otherwise new material with given id.
+def get_material(material_pool, mat_id, mat_type, color, obj=None):
+    if material_pool is None:
+        return create_material(mat_id, mat_type, color)
+    return material_pool.get(mat_type, color, obj)
+
+# Enum values of Keyframe.interpolation and Keyframe.easing for foreach_set.
+keyframe_interpolation_values = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2, 'SINE': 3, 'QUAD': 4, 'CUBIC': 5, 'QUART': 6, 'QUINT': 7, 'EXPO': 8, 'CIRC': 9, 'BACK': 10, 'BOUNCE': 11, 'ELASTIC': 12}
+keyframe_easing_values = {'AUTO': 0, 'EASE_IN': 1, 'EASE_OUT': 2, 'EASE_IN_OUT': 3}
+keyframe_handle_type_values = {'FREE': 0, 'AUTO': 1, 'VECTOR': 2, 'ALIGNED': 3, 'AUTO_CLAMPED': 4}
+
+def get_or_create_action(id_data):
+    anim_data = id_data.animation_data
+    if anim_data is None:
+        anim_data = id_data.animation_data_create()
+    if anim_data.action is None:
+        anim_data.action = bpy.data.actions.new(id_data.name + "Action")
+    return anim_data.action
+
+def get_or_create_action_fcurve(action, data_path, index=0, group=None):
+    fcurve = action.fcurves.find(data_path, index=index)
+    if fcurve is None:
+        fcurve = action.fcurves.new(data_path, index=index, action_group=group or "")
+    return fcurve
+
+def get_or_create_fcurve(id_data, data_path, index=0, group=None):
+    return get_or_create_action_fcurve(get_or_create_action(id_data), data_path, index, group)
+
+# Write all keys of one fcurve of action at once instead of calling keyframe_insert per key.
+# Existing keys on the same frames are replaced, interpolation and easing are set in same pass.
+def write_action_keyframes(action, data_path, frames, values, index=0, interpolation='BEZIER', easing='AUTO', group=None):
+    fcurve = get_or_create_action_fcurve(action, data_path, index, group)
+    co = np.stack((np.asarray(frames, dtype=np.float32), np.asarray(values, dtype=np.float32)), axis=1)
+    keyframe_points = fcurve.keyframe_points
+    if len(keyframe_points) > 0:
+        existing_co = foreach_get_array(keyframe_points, "co", 2)
+        existing_co = existing_co[~np.isin(existing_co[:, 0], co[:, 0])]
+        co = np.concatenate((existing_co, co))
+        keyframe_points.clear()
+    # Last written value wins for duplicate frames.
+    _, last = np.unique(co[::-1, 0], return_index=True)
+    co = co[::-1][last]
+    keyframe_points.add(len(co))
+    foreach_set_array(keyframe_points, "co", co)
+    keyframe_points.foreach_set("interpolation", np.full(len(co), keyframe_interpolation_values[interpolation], dtype=np.int32))
+    keyframe_points.foreach_set("easing", np.full(len(co), keyframe_easing_values[easing], dtype=np.int32))
+    fcurve.update()
+    return fcurve
+
+# Same as write_action_keyframes, on action of id_data (created if needed).
+def write_keyframes(id_data, data_path, frames, values, index=0, interpolation='BEZIER', easing='AUTO', group=None):
+    return write_action_keyframes(get_or_create_action(id_data), data_path, frames, values, index, interpolation, easing, group)
+
+# Keyframe vector property (e.g. location) for many frames: values is (n_frames, n_components).
+def write_vector_keyframes(id_data, data_path, frames, values, interpolation='BEZIER', easing='AUTO', group=None):
+    values = np.asarray(values).reshape(len(frames), -1)
+    return [write_keyframes(id_data, data_path, frames, values[:, i], i, interpolation, easing, group) for i in range(values.shape[1])]
+
+# Replace keys of vector property with kept samples of (n_frames, n_components) values as Bezier keys
+# with FREE handles along given slopes (see curve_draw_sim.decimate_trajectory).
+def write_bezier_keyframes(id_data, data_path, frames, values, kept, slopes, group=None):
+    frames = np.asarray(frames, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(frames), -1)
+    (left_frames, left_values), (right_frames, right_values) = curve_draw_sim.bezier_handles(frames, values, kept, slopes)
+    fcurves = []
+    for i in range(values.shape[1]):
+        fcurve = get_or_create_fcurve(id_data, data_path, i, group)
+        keyframe_points = fcurve.keyframe_points
+        keyframe_points.clear()
+        keyframe_points.add(len(kept))
+        foreach_set_array(keyframe_points, "co", np.stack((frames[kept], values[kept, i]), axis=1))
+        foreach_set_array(keyframe_points, "handle_left", np.stack((left_frames, left_values[:, i]), axis=1))
+        foreach_set_array(keyframe_points, "handle_right", np.stack((right_frames, right_values[:, i]), axis=1))
+        keyframe_points.foreach_set("interpolation", np.full(len(kept), keyframe_interpolation_values['BEZIER'], dtype=np.int32))
+        keyframe_points.foreach_set("handle_left_type", np.full(len(kept), keyframe_handle_type_values['FREE'], dtype=np.int32))
+        keyframe_points.foreach_set("handle_right_type", np.full(len(kept), keyframe_handle_type_values['FREE'], dtype=np.int32))
+        fcurve.update()
+        fcurves.append(fcurve)
+    return fcurves
+
+def animate_curve_growth(curve, frame_start, frame_end, growth_factor_end, start_growth, interpolation='BEZIER', easing='AUTO'):
+    set_instance_property(curve, "bevel_factor_end", start_growth)
+    set_instance_property(curve, "bevel_factor_start", 0)
+    owner, data_path = get_instance_property_target(curve, "bevel_factor_end")
+    write_keyframes(owner, data_path, [frame_start, frame_end], [start_growth, growth_factor_end], interpolation=interpolation, easing=easing)
+
+# Keys of thickness held at start_thickness until frame_start, then every frame_delta frames
+# changing randomly by up to +-thickness_wobble of previous thickness.
+def curve_thickening_keys(start_thickness, frame_start, frame_delta, n_periods, thickness_wobble=0.2, frame_rest=0, rng=None):
+    frames = [frame_rest, frame_start]
+    values = [start_thickness, start_thickness]
+    thickness = start_thickness
+    for i in range(n_periods):
+        thickness = lerp(random_value(rng), thickness * (1.0 - thickness_wobble), thickness * (1.0 + thickness_wobble))
+        frames.append(frame_start + (i + 1) * frame_delta)
+        values.append(thickness)
+    return frames, values
+
+# Thickening and shrinking of curve as single key plus procedural Noise F-Modifier, so memory per
+# instance does not depend on animation length. Noise starts at frame_start (blended in over one period)
+# and changes thickness by about +-thickness_wobble of start_thickness. phase selects instance's noise.
+def animate_curve_thickness_noise(curve, start_thickness, frame_start, period, frame_end, thickness_wobble=0.2, phase=0.0, frame_rest=0):
+    set_instance_property(curve, "bevel_depth", start_thickness)
+    owner, data_path = get_instance_property_target(curve, "bevel_depth")
+    fcurve = write_keyframes(owner, data_path, [frame_rest], [start_thickness])
+    noise = fcurve.modifiers.new('NOISE')
+    # REPLACE adds centred (noise - 0.5) * strength, in [-0.5, 0.5] * strength (ADD would add [0, 1] * strength).
+    noise.blend_type = 'REPLACE'
+    noise.scale = period
+    noise.strength = 2.0 * thickness_wobble * start_thickness
+    noise.phase = phase
+    noise.depth = 0
+    noise.use_restricted_range = True
+    noise.frame_start = frame_start
+    noise.frame_end = frame_end
+    noise.blend_in = period
+    return noise
+
+# Library of n_templates growth and thickening actions shared by all curve instances, instead of action per instance.
+# Data paths are taken from sample_curve, so library works for copied (curve data) and linked (object) instances alike.
+def create_curve_action_library(sample_curve, n_templates, n_frames, bevel_thickening_period, name_prefix="curve_template", rng=None):
+    owner, growth_path = get_instance_property_target(sample_curve, "bevel_factor_end")
+    _, bevel_path = get_instance_property_target(sample_curve, "bevel_depth")
+    actions = []
+    for i in range(n_templates):
+        action = bpy.data.actions.new("{}_{}".format(name_prefix, i))
+        action.id_root = owner.id_type
+        end_mapping_animation = lerp(random_value(rng), 0.7, 1.0)
+        start_mapping_animation = lerp(random_value(rng), 0.01, 0.1)
+        write_action_keyframes(action, growth_path, [0, n_frames], [start_mapping_animation, end_mapping_animation], interpolation="CUBIC", easing="EASE_OUT")
+        bevel_depth = random_value(rng) * 0.7 + 0.1
+        delta_frame_bevel = int(n_frames / bevel_thickening_period)
+        frames, values = curve_thickening_keys(bevel_depth, frame_start=30, frame_delta=delta_frame_bevel, n_periods=bevel_thickening_period, thickness_wobble=0.2, rng=rng)
+        write_action_keyframes(action, bevel_path, frames, values)
+        actions.append(action)
+    return actions
+
+# Play shared action on curve instance through NLA strip shifted by frame_offset and stretched by scale.
+def assign_curve_action(curve, action, frame_offset=0, scale=1.0):
+    set_instance_property(curve, "bevel_factor_start", 0)
+    owner, _ = get_instance_property_target(curve, "bevel_factor_end")
+    anim_data = owner.animation_data
+    if anim_data is None:
+        anim_data = owner.animation_data_create()
+    track = anim_data.nla_tracks.new()
+    track.name = action.name
+    strip = track.strips.new(action.name, int(round(frame_offset)), action)
+    strip.scale = scale
+    strip.extrapolation = 'HOLD'
+    return strip
 
 # Based on: https://blog.federicopepe.com/en/2020/05/create-random-palettes-of-colors-that-will-go-well-together/
-def generate_5_random_colors_that_fit():
-    hue = int(mathutils.noise.random() * 360.0) # Random between [0,360]
-    hue_op = int(mathutils.noise.random() * 180.0) # Random between [0,180]
+def generate_5_random_colors_that_fit(rng=None):
+    hue = int(random_value(rng) * 360.0) # Random between [0,360]
+    hue_op = int(random_value(rng) * 180.0) # Random between [0,180]
     hues = [
         hue,
         hue - hue_op,
@@ -148,133 +848,762 @@ def generate_5_random_colors_that_fit():
     rand_cols = []
     for i in range (5):
         col = mathutils.Color()
-        col.hsv = (hues[i]/360.0, mathutils.noise.random(), mathutils.noise.random())
+        col.hsv = (hues[i]/360.0, random_value(rng), random_value(rng))
         rand_cols.append(col)
     return rand_cols
 
-def generate_n_gradient_colors_with_same_random_hue(n=10, input_hue=mathutils.noise.random()):
+# Random hue if input_hue is None (drawn at call, not once at import).
+def generate_n_gradient_colors_with_same_random_hue(n=10, input_hue=None, rng=None):
+    if input_hue is None:
+        input_hue = random_value(rng)
     rand_cols = []
     for i in range(n):
         col = mathutils.Color()
-        col.hsv = (input_hue, mathutils.noise.random(), mathutils.noise.random())
+        col.hsv = (input_hue, random_value(rng), random_value(rng))
         rand_cols.append(col)
     return rand_cols
 
-def spawn_and_animate_spheres_in_bb(obj, n_spheres, r_min=1, r_max=3, mat_type="diffuse", diff_col=mathutils.Color((1,1,1)), emission_intensity=10, movement_intensity=5.0, n_frames=100):
-    # Find BB corners in world space.
-    bb = obj.bound_box
-    bb_vecs = []
-    world_translation = obj.matrix_basis.to_translation()
-    world_rotation = obj.matrix_basis.to_euler()
-    for bb_i in bb:
-        bb_vec = mathutils.Vector((bb_i[0], bb_i[1], bb_i[2])) # BB in local space.
-        bb_vec += world_translation
-        bb_vec.rotate(world_rotation)
-        bb_vecs.append(bb_vec)
-        #bpy.ops.mesh.primitive_ico_sphere_add(radius=1, enter_editmode=False, align='WORLD', location=bb_i, scale=(1, 1, 1))
-        #bpy.context.selected_objects[0].name = str(bb_vec[0]) + "_" + str(bb_vec[1]) + "_" + str(bb_vec[2])
-    #bpy.ops.mesh.primitive_cube_add(size=2, enter_editmode=False, align='WORLD', location=bb_vecs[0], scale=(1, 1, 1))
-    #bpy.ops.mesh.primitive_cube_add(size=2, enter_editmode=False, align='WORLD', location=bb_vecs[-2], scale=(1, 1, 1))
+# Metaball object with single ball element, created directly in bpy.data.
+# Unlike bpy.ops.object.metaball_add it does no context check, undo push or scene update,
+# does not depend on selection and works in background mode. Object is not linked to scene.
+def create_metaball_obj(name, radius, location, element_type='BALL'):
+    mball_data = bpy.data.metaballs.new(name)
+    element = mball_data.elements.new(type=element_type)
+    element.co = (0.0, 0.0, 0.0)
+    element.radius = radius
+    mball = bpy.data.objects.new(name, mball_data)
+    mball.location = location
+    return mball
+
+# Link many objects at once, to scene collection if collection_name is None.
+def link_objects_to_collection(objs, collection_name=None):
+    if collection_name == None:
+        collection = bpy.context.collection if bpy.context.collection is not None else bpy.context.scene.collection
+    else:
+        create_collection_if_not_exists(collection_name)
+        collection = bpy.data.collections[collection_name]
+    for obj in objs:
+        collection.objects.link(obj)
+
+# Local space BB of obj as (min, max) corners.
+def get_local_bb(obj):
+    bb = np.array([corner[:] for corner in obj.bound_box], dtype=np.float64)
+    return bb.min(axis=0), bb.max(axis=0)
+
+# Random sphere locations and radii in BB of obj. Returns list of (location, radius).
+# Locations are uniform in local BB, transformed by matrix_world, so BB follows object's scale and rotation.
+def sample_spheres_in_bb(obj, n_spheres, r_min=1, r_max=3, rng=None):
+    bb_min, bb_max = get_local_bb(obj)
+    spheres = []
+    for i in range(n_spheres):
+        loc_x = lerp(random_value(rng), bb_min[0], bb_max[0])
+        loc_y = lerp(random_value(rng), bb_min[1], bb_max[1])
+        loc_z = lerp(random_value(rng), bb_min[2], bb_max[2])
+        radius = lerp(random_value(rng), r_min, r_max)
+        spheres.append((obj.matrix_world @ mathutils.Vector((loc_x, loc_y, loc_z)), radius))
+    return spheres
+
+# Non overlapping (blue noise) spheres: any two are at least (r_i + r_j) * separation_scale apart.
+# region "bb": in BB of obj oriented by its matrix_world, "curve_band": at distance [band_min, band_max] from curve.
+# Spheres which do not fit are dropped. Returns list of (location, radius).
+def sample_spheres_poisson(obj, n_spheres, r_min=1, r_max=3, region="bb", band_min=0.0, band_max=10.0, separation_scale=1.0, max_attempts=30, rng=None):
+    if rng is None:
+        rng = np.random.default_rng(int(mathutils.noise.random() * 2**31))
+    radii = rng.uniform(r_min, r_max, size=n_spheres)
+    curve_points = sample_curve_points(obj) if region == "curve_band" else None
+    if curve_points is not None and len(curve_points) == 0:
+        print("{} has no curve points, spheres are sampled in its BB.".format(obj.name))
+        curve_points = None
+    if curve_points is not None:
+        sample_candidates = lambda k: curve_draw_sim.sample_points_near_curve(rng, k, curve_points, band_min, band_max)
+    else:
+        bb_min, bb_max = get_local_bb(obj)
+        matrix_world = np.array(obj.matrix_world)
+        sample_candidates = lambda k: curve_draw_sim.sample_points_in_box(rng, k, bb_min, bb_max, matrix_world)
+    locations, radii = curve_draw_sim.poisson_disk_sample(sample_candidates, radii, separation_scale, max_attempts)
+    if len(locations) < n_spheres:
+        print("Poisson disk sampling placed {} of {} spheres for {}.".format(len(locations), n_spheres, obj.name))
+    return [(mathutils.Vector(location), radius) for location, radius in zip(locations, radii)]
+
+def get_mball_material(material_pool, mball, mat_type="diffuse", diff_col=mathutils.Color((1,1,1)), emission_intensity=10):
+    if mat_type == "emission":
+        return get_material(material_pool, mball.name+"_mat", "emission", mathutils.Color((emission_intensity, emission_intensity, emission_intensity)), mball)
+    return get_material(material_pool, mball.name+"_mat", "diffuse", diff_col, mball)
+
+# Blender merges metaball objects whose names differ only by ".001"-like suffix into one family and polygonizes
+# family over its whole BB, with resolution and threshold of family's base object. Same values are set on every
+# member, so it does not matter which one is base. None keeps Blender default.
+def set_mball_family_settings(mball_data, resolution=None, render_resolution=None, threshold=None):
+    if resolution is not None:
+        mball_data.resolution = resolution
+    if render_resolution is not None:
+        mball_data.render_resolution = render_resolution
+    if threshold is not None:
+        mball_data.threshold = threshold
+
+# Family (base name) of mball at location: family_name, or with cluster_size one family per grid cell of that size.
+def get_mball_family_name(family_name, location, cluster_size=None):
+    if cluster_size is None:
+        return family_name
+    cell = [int(np.floor(c / cluster_size)) for c in location]
+    return "{}_{}_{}_{}".format(family_name, cell[0], cell[1], cell[2])
+
+def spawn_spheres_in_bb(obj, n_spheres, r_min=1, r_max=3, mat_type="diffuse", diff_col=mathutils.Color((1,1,1)), emission_intensity=10, collection_name=None, material_pool=None,
+        family_name="Mball", cluster_size=None, resolution=None, render_resolution=None, threshold=None, spheres=None, emission_intensity_max=None, rng=None):
+    if spheres is None:
+        spheres = sample_spheres_in_bb(obj, n_spheres, r_min, r_max)
     # Spawn spheres.
     mballs = []
-    for i in range(n_spheres):
-        loc_x = lerp(mathutils.noise.random(), bb_vecs[0].x, bb_vecs[-2].x)
-        loc_y = lerp(mathutils.noise.random(), bb_vecs[0].y, bb_vecs[-2].y)
-        loc_z = lerp(mathutils.noise.random(), bb_vecs[0].z, bb_vecs[-2].z)
-        radius = lerp(mathutils.noise.random(), r_min, r_max)
-        bpy.ops.object.metaball_add(type='BALL', radius=radius, enter_editmode=False, align='WORLD', location=mathutils.Vector((loc_x, loc_y, loc_z)), scale=(1, 1, 1))
-        mball = bpy.context.selected_objects[0]
+    for location, radius in spheres:
+        mball = create_metaball_obj(get_mball_family_name(family_name, location, cluster_size), radius, location)
+        set_mball_family_settings(mball.data, resolution, render_resolution, threshold)
         mballs.append(mball)
-        mball.keyframe_insert("location", frame=0)
+        # Add material, with emission_intensity_max intensity is random in [emission_intensity, emission_intensity_max].
+        intensity = emission_intensity if emission_intensity_max is None else lerp(random_value(rng), emission_intensity, emission_intensity_max)
+        mball.data.materials.append(get_mball_material(material_pool, mball, mat_type, diff_col, intensity))
+    link_objects_to_collection(mballs, collection_name)
+    return mballs
+
+# Metaball object at origin holding every sphere as element of one datablock. Element co is world location.
+def create_metaball_family_obj(name, spheres, element_type='BALL'):
+    mball_data = bpy.data.metaballs.new(name)
+    for location, radius in spheres:
+        element = mball_data.elements.new(type=element_type)
+        element.co = location
+        element.radius = radius
+    mball = bpy.data.objects.new(name, mball_data)
+    # Simulation moves its elements instead of object.
+    mball["mball_family"] = True
+    return mball
+
+# All spheres in BB of obj as elements of single metaball object with single material.
+def spawn_sphere_family_in_bb(obj, n_spheres, r_min=1, r_max=3, mat_type="diffuse", diff_col=mathutils.Color((1,1,1)), emission_intensity=10, collection_name=None, material_pool=None,
+        family_name=None, resolution=None, render_resolution=None, threshold=None, spheres=None, emission_intensity_max=None, rng=None):
+    if spheres is None:
+        spheres = sample_spheres_in_bb(obj, n_spheres, r_min, r_max)
+    mball = create_metaball_family_obj(family_name or obj.name + "_mball", spheres)
+    set_mball_family_settings(mball.data, resolution, render_resolution, threshold)
+    intensity = emission_intensity if emission_intensity_max is None else lerp(random_value(rng), emission_intensity, emission_intensity_max)
+    mball.data.materials.append(get_mball_material(material_pool, mball, mat_type, diff_col, intensity))
+    link_objects_to_collection([mball], collection_name)
+    return [mball]
+
+# Simulated balls of mball objects as (object, element index) pairs. Element index is None for
+# single sphere objects, which move by object location; family objects move their elements.
+def get_mball_balls(mballs):
+    balls = []
+    for mball in mballs:
+        if mball.get("mball_family"):
+            balls += [(mball, i) for i in range(len(mball.data.elements))]
+        else:
+            balls.append((mball, None))
+    return balls
+
+# World location of every ball. Returns (n_balls, 3).
+def get_mball_locations(mballs):
+    locations = []
+    for mball, element_index in get_mball_balls(mballs):
+        if element_index is None:
+            locations.append(mball.location[:])
+        else:
+            locations.append((mball.matrix_world @ mball.data.elements[element_index].co)[:])
+    return np.array(locations, dtype=np.float64).reshape(-1, 3)
+
+# Keyframe simulated (n_balls, n_frames, 3) trajectories on mballs: location of single sphere objects,
+# element co (in object space) of family objects.
+# With tolerance, every trajectory is decimated to fewest Bezier keys within that positional tolerance.
+# Returns number of removed keys (per channel).
+def apply_mball_trajectories(mballs, frames, trajectories, tolerance=None):
+    n_removed = 0
+    for (mball, element_index), trajectory in zip(get_mball_balls(mballs), trajectories):
+        if element_index is None:
+            mball.location = trajectory[0]
+            owner = mball
+            data_path = "location"
+            group = "Object Transforms"
+        else:
+            matrix_world_inv = np.array(mball.matrix_world.inverted())
+            trajectory = trajectory @ matrix_world_inv[:3, :3].T + matrix_world_inv[:3, 3]
+            mball.data.elements[element_index].co = trajectory[0]
+            owner = mball.data
+            data_path = "elements[{}].co".format(element_index)
+            group = None
+        if tolerance is None:
+            write_vector_keyframes(owner, data_path, frames, trajectory, group=group)
+            continue
+        kept, slopes = curve_draw_sim.decimate_trajectory(frames, trajectory, tolerance)
+        write_bezier_keyframes(owner, data_path, frames, trajectory, kept, slopes, group=group)
+        n_removed += (len(frames) - len(kept)) * 3
+    if tolerance is not None:
+        print("Keyframe decimation removed {} of {} mball location keys.".format(n_removed, len(trajectories) * len(frames) * 3))
+    return n_removed
+
+# Random walk of mballs (of one or many drawings) simulated together and keyframed every frame_step frames.
+# With compute_pool (curve_draw_pool.ComputePool) trajectories are simulated in worker processes.
+# Returns trajectories at keyframes and first collision steps (see apply_mball_substep_trajectories).
+def animate_mballs(mballs, movement_intensity=5.0, n_frames=100, frame_step=10, n_substeps=1, noise_seed=0, keyframe_tolerance=None, compute_pool=None, detect_collisions=False):
+    frames = curve_draw_sim.trajectory_frames(n_frames, frame_step)
+    start_locations = get_mball_locations(mballs)
+    # Every substep is recorded (same positions as substeps), so collisions are checked at each of them.
+    n_steps = (len(frames) - 1) * n_substeps
+    if compute_pool is not None:
+        trajectories = compute_pool.simulate_brownian_motion(start_locations, n_steps, movement_intensity=movement_intensity / n_substeps, n_substeps=1, noise_seed=noise_seed)
+    else:
+        trajectories = curve_draw_sim.simulate_brownian_motion(start_locations, n_steps, movement_intensity / n_substeps, 1, noise_seed)
+    return apply_mball_substep_trajectories(mballs, frames, trajectories, n_substeps, keyframe_tolerance, detect_collisions)
+
+# Keyframe every n_substeps-th step of substep trajectories (see animate_mballs). Returns trajectories at frames and
+# first step (index of frames) of collision of every ball checked at every substep, or None if not detect_collisions.
+def apply_mball_substep_trajectories(mballs, frames, substep_trajectories, n_substeps, keyframe_tolerance=None, detect_collisions=False):
+    trajectories = substep_trajectories[:, ::n_substeps]
+    apply_mball_trajectories(mballs, frames, trajectories, keyframe_tolerance)
+    first_steps = None
+    if detect_collisions:
+        first_steps = curve_draw_sim.first_substep_collision_steps(substep_trajectories, get_mball_radii(mballs), n_substeps)
+    return trajectories, first_steps
+
+# Radius of every ball (see get_mball_balls).
+def get_mball_radii(mballs):
+    return np.array([mball.data.elements[element_index or 0].radius for mball, element_index in get_mball_balls(mballs)], dtype=np.float64)
+
+# Switch mball color to collision_color at frame of its first collision.
+# Color is "instance_color" object property, so mballs need material from AttributeMaterialPool.
+# Elements of family objects share object's material and keep their color.
+def keyframe_mball_collision_colors(mballs, frames, first_steps, collision_color):
+    for (mball, element_index), first_step in zip(get_mball_balls(mballs), first_steps):
+        if first_step < 0 or element_index is not None:
+            continue
+        color = tuple(mball.get("instance_color", (1.0, 1.0, 1.0)))
+        write_vector_keyframes(mball, '["instance_color"]', [frames[0], frames[first_step]], [color, tuple(collision_color[:])], interpolation='CONSTANT')
+
+# World space points along every spline of curve object, list of (N_i,3). Bezier segments are sampled with resolution points.
+def sample_curve_splines(curve_obj, resolution=12):
+    matrix_world = np.array(curve_obj.matrix_world)
+    splines_co = []
+    for spline in curve_obj.data.splines:
+        samples = []
+        if spline.type == "BEZIER":
+            points = list(spline.bezier_points)
+            segments = list(zip(points[:-1], points[1:]))
+            if spline.use_cyclic_u and len(points) > 1:
+                segments.append((points[-1], points[0]))
+            for a, b in segments:
+                samples += mathutils.geometry.interpolate_bezier(a.co, a.handle_right, b.handle_left, b.co, resolution)
+            if not segments:
+                samples += [point.co for point in points]
+        else:
+            samples += [point.co.xyz for point in spline.points]
+        local_co = np.array([sample[:] for sample in samples], dtype=np.float64).reshape(-1, 3)
+        splines_co.append(local_co @ matrix_world[:3, :3].T + matrix_world[:3, 3])
+    return splines_co
+
+# World space points along all splines of curve object. Returns (N,3).
+def sample_curve_points(curve_obj, resolution=12):
+    return np.concatenate(sample_curve_splines(curve_obj, resolution) + [np.empty((0, 3))])
+
+# World space points along all splines of curve object and unit tangents in spline direction. Returns (N,3), (N,3).
+def sample_curve_points_and_tangents(curve_obj, resolution=12):
+    points = []
+    tangents = []
+    for spline_co in sample_curve_splines(curve_obj, resolution):
+        if len(spline_co) < 2:
+            continue
+        tangent = np.gradient(spline_co, axis=0)
+        tangent /= np.maximum(np.linalg.norm(tangent, axis=1, keepdims=True), 1e-9)
+        points.append(spline_co)
+        tangents.append(tangent)
+    if not points:
+        return np.empty((0, 3)), np.empty((0, 3))
+    return np.concatenate(points), np.concatenate(tangents)
+
+def build_kdtree(points, indices=None):
+    tree = mathutils.kdtree.KDTree(len(points))
+    if indices is None:
+        indices = range(len(points))
+    for co, index in zip(points, indices):
+        tree.insert(co, index)
+    tree.balance()
+    return tree
+
+# Diffusion limited aggregation: mballs random walk like in simulate_brownian_motion, but freeze as soon as they
+# touch seed point (e.g. sampled drawn curve) or already stuck mball. Stuck mballs go to KD-tree which is rebuilt
+# every rebuild_every insertions; mballs stuck since last rebuild are checked directly.
+# Returns (n_balls, n_steps + 1, 3) trajectories and step at which each mball stuck (-1 if never).
+def simulate_mball_aggregation(start_locations, radii, seed_points, n_steps, movement_intensity=5.0, n_substeps=1, rebuild_every=16, noise_seed=0):
+    locations = np.array(start_locations, dtype=np.float64).reshape(-1, 3)
+    radii = np.asarray(radii, dtype=np.float64)
+    n_balls = len(locations)
+    trajectories = np.empty((n_balls, n_steps + 1, 3))
+    stick_steps = np.full(n_balls, -1, dtype=np.int64)
+    if n_balls == 0:
+        return trajectories, stick_steps
+    seed_tree = build_kdtree(seed_points)
+    max_radius = radii.max()
+    stuck_tree = None
+    stuck_in_tree = []
+    stuck_pending = []
+    for i_step in range(n_steps + 1):
+        if i_step > 0:
+            moving = stick_steps < 0
+            for i_substep in range(n_substeps):
+                locations[moving] += curve_draw_noise.noise_vector(locations[moving], seed=noise_seed) * (movement_intensity / n_substeps)
+        for i in np.nonzero(stick_steps < 0)[0]:
+            co = mathutils.Vector(locations[i])
+            _, _, seed_dist = seed_tree.find(co)
+            stuck = seed_dist is not None and seed_dist < radii[i]
+            if not stuck and stuck_tree is not None:
+                stuck = any(dist < radii[i] + radii[j] for _, j, dist in stuck_tree.find_range(co, radii[i] + max_radius))
+            if not stuck and stuck_pending:
+                dist = np.linalg.norm(locations[stuck_pending] - locations[i], axis=1)
+                stuck = bool(np.any(dist < radii[i] + radii[stuck_pending]))
+            if not stuck:
+                continue
+            stick_steps[i] = i_step
+            stuck_pending.append(i)
+            if len(stuck_pending) >= rebuild_every:
+                stuck_in_tree += stuck_pending
+                stuck_pending = []
+                stuck_tree = build_kdtree(locations[stuck_in_tree], stuck_in_tree)
+        trajectories[:, i_step] = locations
+    return trajectories, stick_steps
+
+# Aggregate mballs around drawings and keyframe their trajectories and "stuck" flag at stick frame.
+def animate_mballs_aggregation(mballs, drawings, movement_intensity=5.0, n_frames=100, frame_step=10, n_substeps=1, rebuild_every=16, noise_seed=0, keyframe_tolerance=None):
+    frames = curve_draw_sim.trajectory_frames(n_frames, frame_step)
+    start_locations = get_mball_locations(mballs)
+    seed_points = np.concatenate([sample_curve_points(drawing) for drawing in drawings] + [np.empty((0, 3))])
+    if len(seed_points) == 0:
+        raise ValueError("Drawings have no curve points for metaballs to aggregate on.")
+    trajectories, stick_steps = simulate_mball_aggregation(start_locations, get_mball_radii(mballs), seed_points, len(frames) - 1, movement_intensity, n_substeps, rebuild_every, noise_seed)
+    apply_mball_trajectories(mballs, frames, trajectories, keyframe_tolerance)
+    for (mball, element_index), stick_step in zip(get_mball_balls(mballs), stick_steps):
+        if element_index is not None:
+            continue
+        mball["stuck"] = 0.0
+        if stick_step >= 0:
+            write_keyframes(mball, '["stuck"]', [frames[0], frames[stick_step]], [0.0, 1.0], interpolation='CONSTANT')
+    return trajectories, stick_steps
+
+# Velocity grid over drawings' BB (padded by margin) which streams along nearest drawing and swirls with curl noise.
+# Nearest curve point of every grid point is found once with KD-tree. Returns field, bb_min, bb_max.
+def create_flow_field(drawings, resolution=48, margin=10.0, tangent_strength=1.0, attraction_strength=0.3, curl_strength=0.5, falloff=5.0, curl_scale=0.1, noise_seed=0):
+    points = []
+    tangents = []
+    for drawing in drawings:
+        drawing_points, drawing_tangents = sample_curve_points_and_tangents(drawing)
+        points.append(drawing_points)
+        tangents.append(drawing_tangents)
+    points = np.concatenate(points + [np.empty((0, 3))])
+    tangents = np.concatenate(tangents + [np.empty((0, 3))])
+    if len(points) == 0:
+        raise ValueError("Drawings have no curve points to build flow field around.")
+    bb_min = points.min(axis=0) - margin
+    bb_max = points.max(axis=0) + margin
+    grid = curve_draw_sim.grid_points(bb_min, bb_max, resolution)
+    tree = build_kdtree(points)
+    nearest = [tree.find(co)[1] for co in grid.reshape(-1, 3)]
+    field = curve_draw_sim.build_flow_field(grid, points[nearest], tangents[nearest], tangent_strength, attraction_strength, curl_strength, falloff, curl_scale, noise_seed)
+    return field, bb_min, bb_max
+
+# Advect mballs through flow field around drawings and keyframe trajectories. Returns same as animate_mballs.
+def animate_mballs_in_flow_field(mballs, drawings, movement_intensity=5.0, n_frames=100, frame_step=10, n_substeps=1, resolution=48, margin=10.0, tangent_strength=1.0, attraction_strength=0.3, curl_strength=0.5, falloff=5.0, noise_seed=0, keyframe_tolerance=None, compute_pool=None, detect_collisions=False):
+    frames = curve_draw_sim.trajectory_frames(n_frames, frame_step)
+    field, bb_min, bb_max = create_flow_field(drawings, resolution, margin, tangent_strength, attraction_strength, curl_strength, falloff, noise_seed=noise_seed)
+    start_locations = get_mball_locations(mballs)
+    n_steps = (len(frames) - 1) * n_substeps
+    if compute_pool is not None:
+        trajectories = compute_pool.advect_in_flow_field(start_locations, field, bb_min, bb_max, n_steps, movement_intensity=movement_intensity / n_substeps, n_substeps=1)
+    else:
+        trajectories = curve_draw_sim.advect_in_flow_field(start_locations, field, bb_min, bb_max, n_steps, movement_intensity / n_substeps, 1)
+    return apply_mball_substep_trajectories(mballs, frames, trajectories, n_substeps, keyframe_tolerance, detect_collisions)
+
+# Family base name of metaball object: name without ".001"-like suffix.
+def get_mball_family_base_name(name):
+    base, sep, number = name.rpartition(".")
+    if sep and number.isdigit():
+        return base
+    return name
+
+# Mball objects grouped by family. Returns dict base name -> list of objects.
+def get_mball_families(mballs):
+    families = {}
+    for mball in mballs:
+        families.setdefault(get_mball_family_base_name(mball.name), []).append(mball)
+    return families
+
+# World size of one pixel at distance from camera.
+def get_camera_pixel_size(camera, scene, distance):
+    render = scene.render
+    scale = render.resolution_percentage / 100.0
+    n_pixels = max(render.resolution_x * render.pixel_aspect_x, render.resolution_y * render.pixel_aspect_y) * scale
+    if camera.data.type == 'ORTHO':
+        return camera.data.ortho_scale / n_pixels
+    # Camera angle spans larger image dimension (sensor fit AUTO).
+    return 2.0 * distance * np.tan(camera.data.angle / 2.0) / n_pixels
+
+# Bounding sphere (center, radius) of family's balls in world space.
+def get_mball_family_bounding_sphere(mballs):
+    locations = get_mball_locations(mballs)
+    radii = []
+    for mball, element_index in get_mball_balls(mballs):
+        scale = max(mball.matrix_world.to_scale())
+        if element_index is None:
+            radii += [element.radius * scale for element in mball.data.elements]
+        else:
+            radii.append(mball.data.elements[element_index].radius * scale)
+    center = (locations.min(axis=0) + locations.max(axis=0)) / 2.0
+    radius = np.max(np.linalg.norm(locations - center, axis=1) + np.max(radii))
+    return center, radius
+
+# Set resolution of every family from its size on screen at camera: polygonization grid cell of about
+# target_pixels pixels at family's nearest point, clamped to [min_resolution, max_resolution].
+# Viewport resolution is render resolution times viewport_factor.
+def update_mball_lod(mballs, camera, scene, target_pixels=4.0, min_resolution=0.05, max_resolution=2.0, viewport_factor=2.0):
+    camera_location = np.array(camera.matrix_world.translation)
+    for family in get_mball_families(mballs).values():
+        center, radius = get_mball_family_bounding_sphere(family)
+        distance = max(np.linalg.norm(center - camera_location) - radius, camera.data.clip_start)
+        resolution = float(np.clip(get_camera_pixel_size(camera, scene, distance) * target_pixels, min_resolution, max_resolution))
+        for mball in family:
+            set_mball_family_settings(mball.data, resolution=min(resolution * viewport_factor, max_resolution), render_resolution=resolution)
+
+# Name of text datablock which registers LOD handler when saved .blend is loaded.
+mball_lod_text_name = "mball_lod_handler.py"
+
+# Update metaball LOD of scene on every frame change (also while rendering animation) for moving mballs or camera.
+# Settings and mball names are stored in scene["mball_lod"] (see register_mball_lod_handler), so they are saved
+# with .blend, and handler is persistent, so it survives loading other files. Objects are looked up by name.
+@bpy.app.handlers.persistent
+def mball_lod_handler(scene, depsgraph=None):
+    settings = scene.get("mball_lod")
+    if settings is None or scene.camera is None:
+        return
+    lod_mballs = [bpy.data.objects[name] for name in settings["objects"] if name in bpy.data.objects]
+    if lod_mballs:
+        update_mball_lod(lod_mballs, scene.camera, scene, settings["target_pixels"], settings["min_resolution"], settings["max_resolution"], settings["viewport_factor"])
+
+mball_lod_handler.mball_lod = True
+
+# LOD handlers (also of other imports of this script) are recognized by mball_lod attribute.
+def unregister_mball_lod_handler():
+    for handler in list(bpy.app.handlers.frame_change_post):
+        if getattr(handler, "mball_lod", False):
+            bpy.app.handlers.frame_change_post.remove(handler)
+
+# Remove LOD handler, its settings from scene and its registration text.
+def remove_mball_lod_handler(scene=None):
+    unregister_mball_lod_handler()
+    scene = scene or bpy.context.scene
+    if "mball_lod" in scene:
+        del scene["mball_lod"]
+    text = bpy.data.texts.get(mball_lod_text_name)
+    if text is not None:
+        bpy.data.texts.remove(text)
+
+# Per frame metaball LOD of mballs in scene (see mball_lod_handler). Without mballs only (re)registers handler
+# for settings already in scene. Handler is registered again when saved .blend is loaded by text datablock run
+# on load, which needs this script's directory and Python auto execution (e.g. blender -b -y file.blend -a).
+def register_mball_lod_handler(mballs=None, target_pixels=4.0, min_resolution=0.05, max_resolution=2.0, viewport_factor=2.0, scene=None):
+    unregister_mball_lod_handler()
+    bpy.app.handlers.frame_change_post.append(mball_lod_handler)
+    if mballs is None:
+        return mball_lod_handler
+    scene = scene or bpy.context.scene
+    scene["mball_lod"] = {"objects": [mball.name for mball in mballs], "target_pixels": target_pixels, "min_resolution": min_resolution,
+        "max_resolution": max_resolution, "viewport_factor": viewport_factor}
+    # Same directories as sys.path setup of this script.
+    script_dirs = [script_dir for script_dir in (os.path.dirname(os.path.abspath(__file__)), bpy.path.abspath("//")) if script_dir and os.path.isdir(script_dir)]
+    text = bpy.data.texts.get(mball_lod_text_name) or bpy.data.texts.new(mball_lod_text_name)
+    text.from_string("\n".join([
+        "# Registers metaball LOD handler of procedural_3d_curve_from_drawing.py when .blend is loaded.",
+        "import os",
+        "import sys",
+        "for script_dir in {!r}:".format(script_dirs),
+        "    if os.path.isdir(script_dir) and script_dir not in sys.path:",
+        "        sys.path.append(script_dir)",
+        "import procedural_3d_curve_from_drawing",
+        "procedural_3d_curve_from_drawing.register_mball_lod_handler()",
+        ""]))
+    text.use_module = True
+    return mball_lod_handler
+
+# Apply phase: curve instances of curve_drawing from its rows of instance plan (see curve_draw_plan.plan_instances).
+# Draws no random numbers. Returns instances and action library (created from first instance when needed).
+# With compute_pool perturbation offsets of all instances are computed in worker processes.
+def apply_instance_plan(curve_drawing, rows, colors, instancing_mode="copy", animation_mode="keyframes", thickness_animation="keyframes", material_pool=None,
+        curve_instance_node_group=None, curve_action_library=None, n_action_templates=8, n_frames=300, bevel_thickening_period=10, emissive_palette_colors=False, noise_cache=None, action_library_rng=None, compute_pool=None):
+    delta_frame_bevel = int(n_frames / bevel_thickening_period)
+    perturb_offsets = None
+    if compute_pool is not None and instancing_mode != "linked":
+        # All copies start with points of drawing.
+        points, n_components = get_spline_points(curve_drawing)
+        co = foreach_get_array(points, "co", n_components)[:, :3]
+        perturb_offsets = compute_pool.perturbation_offsets(co, [int(seed) for seed in rows["seed"]], noise_cache=noise_cache, perturb_scale=1, perturb_strength=1, n_octaves=2, amplitude_scale=1, frequency_scale=2)
+    thickening_frames = curve_draw_plan.thickening_frames(30, delta_frame_bevel, bevel_thickening_period)
+    # Linked instances share one copy of drawing's data, so material slot they add is not added to drawing itself.
+    linked_data = curve_drawing.data.copy() if instancing_mode == "linked" and len(rows) > 0 else None
+    instance_array = []
+    for i_row, row in enumerate(rows):
+        # Create copy.
+        drawing_instance = copy_obj(curve_drawing, "curve_drawing_instance", link_data=(instancing_mode == "linked"))
+        if linked_data is not None:
+            drawing_instance.data = linked_data
+        # Translation of whole curve.
+        drawing_instance.location += mathutils.Vector(row["offset"])
+        # Preturb curve points.
+        if instancing_mode == "linked":
+            # Noise W: instances golden ratio apart (as in geometry nodes backend), shifted by fraction from seed,
+            # so W stays distinct for every instance of drawing and changes with run seed.
+            noise_w = row["instance"] * 1.618 + (row["seed"] % 10**6) / 10**6
+            add_curve_instance_modifier(drawing_instance, curve_instance_node_group, seed=float(noise_w), perturb_scale=1, perturb_strength=1)
+        else:
+            perturb_curve_points(drawing_instance, perturb_scale=1, perturb_strength=1, n_octaves=2, amplitude_scale=1, frequency_scale=2, seed=int(row["seed"]), noise_cache=noise_cache,
+                offsets=(perturb_offsets[i_row] if perturb_offsets is not None else None), noise_cache_uses=len(rows))
         # Add material.
-        if mat_type == "emission":
-            mat = create_material(mball.name+"_mat", "emission", mathutils.Color((emission_intensity, emission_intensity, emission_intensity)))
+        if row["emissive"]:
+            emission_color = colors[row["color_index"] % len(colors)] if emissive_palette_colors else mathutils.Color((1.0, 1.0, 1.0))
+            mat = get_material(material_pool, drawing_instance.name+"_mat", "emission", emission_color * float(row["emission_intensity"]), drawing_instance)
+        else:
+            mat = get_material(material_pool, drawing_instance.name+"_mat", "diffuse", colors[row["color_index"] % len(colors)], drawing_instance)
+        if instancing_mode == "linked":
+            set_object_material(drawing_instance, mat)
         else:
-            mat = create_material(mball.name+"_mat", "diffuse", diff_col)
-        mball.data.materials.append(mat)
-    # Animate.
-    keyframe_delta = 10
-    curr_frame = 10
-    while curr_frame <= n_frames:
-        for mball in mballs:
-            mball.location += mathutils.noise.noise_vector(mball.location) * movement_intensity
-            mball.keyframe_insert("location", frame=curr_frame)
-        curr_frame += keyframe_delta
-
-    
-
-def main():
-
-    # Parameters.
-    curve_drawing_collection_name = "curve_drawing_collection"
-    n_frames = 300
-
-    # Sphere parameters.
-    n_spheres = 20
-    r_min = 2
-    r_max = 4
-    mat_type = "diffuse"
-    diff_col = mathutils.Color((1,1,1))
-    emission_intensity = 10.0
-    movement_intensity = 10.0
-
-    # Curve parameters
-    n_instances_per_drawing = 50
-    translation_rand_strength = 10.0
-    bevel_thickening_period = 10
-    chance_of_emissive_curves = 0.1
-    
-
-    array_of_instance_arrays = []
-    rand_5_colors = generate_5_random_colors_that_fit()
-    curr_draw_curve_idx = 0
-    for curve_drawing in bpy.data.collections[curve_drawing_collection_name].all_objects:
-
-        # Create mballs in BB of current draw curve input. 
-        spawn_and_animate_spheres_in_bb(curve_drawing, n_spheres=n_spheres, r_min=r_min, r_max=r_max, mat_type="diffuse", diff_col=diff_col, emission_intensity=emission_intensity, movement_intensity=movement_intensity, n_frames=n_frames)
-
-        # Generate random color for current draw curve input.
-        hue = rand_5_colors[curr_draw_curve_idx % 5].h
-        rand_colors = generate_n_gradient_colors_with_same_random_hue(n_instances_per_drawing, hue)
-
-        instance_array = []
-        for i_instance_per_drawing in range(n_instances_per_drawing):
-            # Create copy.
-            drawing_instance = copy_obj(curve_drawing, "curve_drawing_instance")
-            # Randomize translation of whole curve.
-            drawing_instance.location += mathutils.Vector((mathutils.noise.random()-0.5, mathutils.noise.random()-0.5, mathutils.noise.random()-0.5)) * translation_rand_strength
-            # Preturb curve points.
-            perturb_curve_points(drawing_instance, perturb_scale=1, perturb_strength=1, n_octaves=2, amplitude_scale=1, frequency_scale=2)
-            # Add material.
-            if mathutils.noise.random() < chance_of_emissive_curves:
-                emission_intensity = 10.0
-                mat = create_material(drawing_instance.name+"_mat", "emission", mathutils.Color((emission_intensity, emission_intensity, emission_intensity)))
-            else:
-                rand_col_idx = int(mathutils.noise.random() * len(rand_colors))
-                mat = create_material(drawing_instance.name+"_mat", "diffuse", rand_colors[rand_col_idx])
             drawing_instance.data.materials.append(mat)
-            # Animate growth.
-            end_mapping_animation = lerp(mathutils.noise.random(), 0.7, 1.0)
-            start_mapping_animation = lerp(mathutils.noise.random(), 0.01, 0.1)
-            animate_curve_growth(drawing_instance, frame_start=0, frame_end=n_frames, growth_factor_end=end_mapping_animation, start_growth=start_mapping_animation)
-            set_animation_fcurve(drawing_instance, option="CUBIC")
-            # Animate thickening.
-            # Set bevel certain bevel depth.
-            drawing_instance.data.bevel_depth = mathutils.noise.random() * 0.7 + 0.1
-            drawing_instance.data.keyframe_insert(data_path="bevel_depth", frame=0)
-            # Animate growing and shrinking.
-            curr_frame_bevel = 30
-            delta_frame_bevel = int(n_frames / bevel_thickening_period)
-            for i in range(bevel_thickening_period):
-                thickness_min = drawing_instance.data.bevel_depth * 0.8
-                thickness_max = drawing_instance.data.bevel_depth * 1.2
-                animate_curve_thickness(drawing_instance, frame_start=curr_frame_bevel, frame_end=curr_frame_bevel+delta_frame_bevel, thickness_min=thickness_min, thickness_max=thickness_max, start_thickness=drawing_instance.data.bevel_depth)
-                curr_frame_bevel += delta_frame_bevel
-            # Store instance.
-            instance_array.append(drawing_instance)
-        array_of_instance_arrays.append(instance_array)
-
-        curr_draw_curve_idx += 1
+        instance_array.append(drawing_instance)
+        if animation_mode == "action_library":
+            if curve_action_library is None:
+                curve_action_library = create_curve_action_library(drawing_instance, n_action_templates, n_frames, bevel_thickening_period, rng=action_library_rng)
+            action = curve_action_library[row["action_index"] % len(curve_action_library)]
+            assign_curve_action(drawing_instance, action, float(row["action_frame_offset"]), float(row["action_scale"]))
+            continue
+        # Animate growth.
+        animate_curve_growth(drawing_instance, frame_start=0, frame_end=n_frames, growth_factor_end=float(row["growth_end"]), start_growth=float(row["growth_start"]), interpolation="CUBIC", easing="EASE_OUT")
+        # Animate thickening.
+        bevel_depth = float(row["bevel_depth"])
+        if thickness_animation == "noise_modifier":
+            animate_curve_thickness_noise(drawing_instance, bevel_depth, frame_start=30, period=delta_frame_bevel, frame_end=n_frames, thickness_wobble=0.2, phase=float(row["thickness_phase"]))
+        else:
+            set_instance_property(drawing_instance, "bevel_depth", bevel_depth)
+            owner, data_path = get_instance_property_target(drawing_instance, "bevel_depth")
+            write_keyframes(owner, data_path, thickening_frames, [bevel_depth, bevel_depth] + row["thickness"].tolist())
+    return instance_array, curve_action_library
+
+def main(
+        # Parameters.
+        curve_drawing_collection_name="curve_drawing_collection",
+        seed=None, # Run seed, every random choice is derived from it. None for new random run (seed is printed to reproduce it).
+        n_frames=300,
+
+        # Sphere parameters.
+        n_spheres=20,
+        r_min=2,
+        r_max=4,
+        mat_type="diffuse",
+        diff_col=mathutils.Color((1,1,1)),
+        emission_intensity=10.0,
+        movement_intensity=10.0,
+        mball_frame_step=10, # Frames between simulated (and keyframed) steps.
+        mball_n_substeps=1,
+        mball_keyframe_tolerance=None, # E.g. 0.5 to keep only keys needed to stay within that distance of simulated path.
+        emission_intensity_max=None, # E.g. 10.0 with emission_intensity 5.0 for random intensity per emissive mball.
+        mball_collision_color=None, # E.g. (1.0, 0.1, 0.1) to recolor mballs when they collide.
+        # "brownian": mballs wander around.
+        # "aggregation": mballs stick to drawings and to each other when they touch (DLA).
+        # "flow": mballs stream along drawings in precomputed flow field.
+        mball_motion="brownian",
+        # "uniform": random in drawing's BB, "poisson": non overlapping in drawing's BB,
+        # "poisson_curve_band": non overlapping at distance [mball_band_min, mball_band_max] from drawing.
+        mball_spawn_sampling="uniform",
+        mball_band_min=2.0,
+        mball_band_max=15.0,
+        mball_separation_scale=1.0, # Minimal distance between mballs in sum of their radii.
+        mball_families=False, # All mballs of drawing as elements of one metaball datablock (one object, one material).
+        # Metaball families (polygonized together): "none" - all mballs in one family (Blender default naming),
+        # "drawing" - one family per drawing, "cluster" - one family per drawing and grid cell of mball_cluster_size.
+        mball_family_partition="drawing",
+        mball_cluster_size=20.0,
+        mball_resolution=0.4, # Viewport.
+        mball_render_resolution=0.2,
+        mball_threshold=0.6,
+        # Metaball LOD from size on screen at scene camera: None - fixed resolutions above,
+        # "static" - set once for spawn locations, "per_frame" - updated in frame change handler
+        # (saved .blend registers it again on load only with Python auto execution, e.g. blender -b -y).
+        mball_lod=None,
+        mball_lod_target_pixels=4.0, # Size of polygonization grid cell on screen.
+        mball_lod_min_resolution=0.05,
+        mball_lod_max_resolution=2.0,
+        aggregation_rebuild_every=16, # Stuck mballs inserted before KD-tree is rebuilt.
+        flow_field_resolution=48,
+        flow_field_margin=10.0,
+        flow_tangent_strength=1.0, # Flow along nearest drawing.
+        flow_attraction_strength=0.3, # Pull towards nearest drawing far from it.
+        flow_curl_strength=0.5, # Swirl.
+        flow_falloff=5.0, # Distance over which flow along drawing fades out.
+
+        # Curve parameters
+        n_instances_per_drawing=50,
+        translation_rand_strength=10.0,
+        bevel_thickening_period=10,
+        chance_of_emissive_curves=0.1,
+        curve_emission_intensity_min=10.0,
+        curve_emission_intensity_max=10.0,
+        emissive_curve_palette_colors=False, # Emissive curves take drawing's palette color instead of white.
+        bevel_min=0.1,
+        bevel_max=0.8,
+        # "copy": each instance gets its own curve data.
+        # "linked": instances share drawing's curve data, variation comes from geometry nodes modifier.
+        # "geometry_nodes": one object per drawing generates all its instances with geometry nodes.
+        instancing_mode="copy",
+        # "keyframes": each instance gets its own growth and thickening action.
+        # "action_library": instances play one of n_action_templates shared actions through NLA strip with random offset and scale.
+        animation_mode="keyframes",
+        n_action_templates=8,
+        action_max_frame_offset=30,
+        action_scale_min=0.8,
+        action_scale_max=1.2,
+        # "keyframes": bevel depth wobble keyed every period.
+        # "noise_modifier": one bevel depth key and Noise F-Modifier with random phase per instance.
+        thickness_animation="keyframes",
+        instance_plan_path=None, # E.g. bpy.path.abspath("//instance_plan.npz") to reuse planned instances between runs with same parameters.
+
+        # Noise parameters.
+        compute_workers=0, # Worker processes for plan, perturbation and mball motion, 0 computes everything in Blender.
+        use_noise_cache=False, # Sample precomputed noise volume instead of evaluating noise per point where cheaper (approximate, see curve_draw_noise.check_noise_cache).
+        noise_cache_samples_per_unit=4, # Volume samples per noise cell of the highest octave.
+        noise_cache_max_bytes=256 * 2**20,
+
+        # Material parameters.
+        # "per_object": each object gets its own material.
+        # "pool": objects with same shader type and quantized color share material.
+        # "attribute": one material for all objects, color stored as object property.
+        material_mode="pool",
+        material_pool_quantization=1.0 / 32.0,
+        material_pool_max_size=64,
+        ):
+
+    # Colors may be given as plain sequences (e.g. from presets).
+    diff_col = mathutils.Color(diff_col)
+    if mball_collision_color is not None:
+        mball_collision_color = mathutils.Color(mball_collision_color)
+
+    noise_cache = None
+    if use_noise_cache:
+        noise_cache = curve_draw_noise.NoiseVolumeCache(samples_per_unit=noise_cache_samples_per_unit, max_bytes=noise_cache_max_bytes)
+
+    material_pool = None
+    if material_mode == "pool":
+        material_pool = MaterialPool(quantization=material_pool_quantization, max_size=material_pool_max_size)
+    if material_mode == "attribute":
+        material_pool = AttributeMaterialPool()
+
+    # Collision color is animated object property, read only by attribute materials.
+    mball_material_pool = material_pool
+    if mball_collision_color is not None and not isinstance(material_pool, AttributeMaterialPool):
+        mball_material_pool = AttributeMaterialPool()
+
+    curve_instance_node_group = None
+    if instancing_mode == "linked":
+        curve_instance_node_group = create_curve_instance_node_group(n_octaves=2, amplitude_scale=1)
+    if instancing_mode == "geometry_nodes":
+        drawing_instances_node_group = create_drawing_instances_node_group(n_octaves=2, amplitude_scale=1)
+        drawing_instances_mat = create_attribute_material("drawing_instances_mat")
+
+    if seed is None:
+        seed = curve_draw_random.random_run_seed()
+    print("Run seed: {}".format(seed))
+
+    compute_pool = None
+    plan_instances = curve_draw_plan.plan_instances
+    if compute_workers > 0:
+        compute_pool = curve_draw_pool.ComputePool(compute_workers)
+        plan_instances = compute_pool.plan_instances
+
+    # Workers are shut down also on error, so they do not keep running in Blender session.
+    try:
+        # Plan phase: random choices of all curve instances up front. Geometry nodes draw their own per instance.
+        curve_drawings = list(bpy.data.collections[curve_drawing_collection_name].all_objects)
+        instance_plan = None
+        if instancing_mode != "geometry_nodes":
+            instance_plan = curve_draw_plan.load_or_plan(instance_plan_path, plan_instances,
+                seed, len(curve_drawings), n_instances_per_drawing, n_colors=n_instances_per_drawing,
+                translation_rand_strength=translation_rand_strength, chance_of_emissive_curves=chance_of_emissive_curves, bevel_min=bevel_min, bevel_max=bevel_max,
+                emission_intensity_min=curve_emission_intensity_min, emission_intensity_max=curve_emission_intensity_max,
+                n_periods=bevel_thickening_period, thickness_wobble=0.2, n_action_templates=n_action_templates, action_max_frame_offset=action_max_frame_offset,
+                action_scale_min=action_scale_min, action_scale_max=action_scale_max)
+
+        # Apply phase.
+        curve_action_library = None
+        array_of_instance_arrays = []
+        all_mballs = []
+        rand_5_colors = generate_5_random_colors_that_fit(rng=curve_draw_random.stream(seed, "palette"))
+        curr_draw_curve_idx = 0
+        for curve_drawing in curve_drawings:
+
+            # Create mballs in BB of current draw curve input. Animated together with other drawings' mballs below.
+            mball_rng = curve_draw_random.stream(seed, curr_draw_curve_idx, "mballs")
+            if mball_spawn_sampling == "uniform":
+                spheres = sample_spheres_in_bb(curve_drawing, n_spheres, r_min, r_max, rng=mball_rng)
+            else:
+                spheres = sample_spheres_poisson(curve_drawing, n_spheres, r_min, r_max, region=("curve_band" if mball_spawn_sampling == "poisson_curve_band" else "bb"),
+                    band_min=mball_band_min, band_max=mball_band_max, separation_scale=mball_separation_scale, rng=mball_rng)
+            family_name = "Mball" if mball_family_partition == "none" else curve_drawing.name + "_mball"
+            if mball_families:
+                all_mballs += spawn_sphere_family_in_bb(curve_drawing, n_spheres=n_spheres, r_min=r_min, r_max=r_max, mat_type=mat_type, diff_col=diff_col, emission_intensity=emission_intensity, emission_intensity_max=emission_intensity_max, rng=mball_rng, material_pool=mball_material_pool,
+                    family_name=family_name, resolution=mball_resolution, render_resolution=mball_render_resolution, threshold=mball_threshold, spheres=spheres)
+            else:
+                all_mballs += spawn_spheres_in_bb(curve_drawing, n_spheres=n_spheres, r_min=r_min, r_max=r_max, mat_type=mat_type, diff_col=diff_col, emission_intensity=emission_intensity, emission_intensity_max=emission_intensity_max, rng=mball_rng, material_pool=mball_material_pool,
+                    family_name=family_name, cluster_size=(mball_cluster_size if mball_family_partition == "cluster" else None),
+                    resolution=mball_resolution, render_resolution=mball_render_resolution, threshold=mball_threshold, spheres=spheres)
+
+            # Generate random color for current draw curve input.
+            hue = rand_5_colors[curr_draw_curve_idx % 5].h
+            rand_colors = generate_n_gradient_colors_with_same_random_hue(n_instances_per_drawing, hue, rng=curve_draw_random.stream(seed, curr_draw_curve_idx, "palette"))
+
+            if instancing_mode == "geometry_nodes":
+                drawing_instances = create_drawing_instances_object(curve_drawing, drawing_instances_node_group, drawing_instances_mat, "curve_drawing_instance",
+                    n_instances=n_instances_per_drawing, seed=curve_draw_random.stream_seed(seed, curr_draw_curve_idx, "geometry_nodes") % 100000, hue=hue, translation_rand_strength=translation_rand_strength,
+                    chance_of_emissive_curves=chance_of_emissive_curves, emission_intensity_min=curve_emission_intensity_min, emission_intensity_max=curve_emission_intensity_max,
+                    emissive_palette_colors=emissive_curve_palette_colors, bevel_min=bevel_min, bevel_max=bevel_max, n_frames=n_frames, bevel_thickening_period=bevel_thickening_period)
+                array_of_instance_arrays.append([drawing_instances])
+                curr_draw_curve_idx += 1
+                continue
+
+            instance_array, curve_action_library = apply_instance_plan(curve_drawing, instance_plan[instance_plan["drawing"] == curr_draw_curve_idx], rand_colors,
+                instancing_mode=instancing_mode, animation_mode=animation_mode, thickness_animation=thickness_animation, material_pool=material_pool,
+                curve_instance_node_group=curve_instance_node_group, curve_action_library=curve_action_library, n_action_templates=n_action_templates,
+                n_frames=n_frames, bevel_thickening_period=bevel_thickening_period, emissive_palette_colors=emissive_curve_palette_colors, noise_cache=noise_cache,
+                action_library_rng=curve_draw_random.stream(seed, "action_library"), compute_pool=compute_pool)
+            array_of_instance_arrays.append(instance_array)
+
+            curr_draw_curve_idx += 1
+
+        # Simulate mballs of all drawings at once.
+        mball_noise_seed = curve_draw_random.stream_seed(seed, "mball_motion")
+        # Drawings list is taken before spawning: mballs may be linked into same collection.
+        if mball_motion == "aggregation":
+            trajectories, first_steps = animate_mballs_aggregation(all_mballs, curve_drawings, movement_intensity=movement_intensity, n_frames=n_frames, frame_step=mball_frame_step, n_substeps=mball_n_substeps, rebuild_every=aggregation_rebuild_every, noise_seed=mball_noise_seed, keyframe_tolerance=mball_keyframe_tolerance)
+        elif mball_motion == "flow":
+            trajectories, first_steps = animate_mballs_in_flow_field(all_mballs, curve_drawings, movement_intensity=movement_intensity, n_frames=n_frames, frame_step=mball_frame_step, n_substeps=mball_n_substeps,
+                resolution=flow_field_resolution, margin=flow_field_margin, tangent_strength=flow_tangent_strength, attraction_strength=flow_attraction_strength, curl_strength=flow_curl_strength, falloff=flow_falloff, noise_seed=mball_noise_seed, keyframe_tolerance=mball_keyframe_tolerance, compute_pool=compute_pool,
+                detect_collisions=(mball_collision_color is not None))
+        else:
+            trajectories, first_steps = animate_mballs(all_mballs, movement_intensity=movement_intensity, n_frames=n_frames, frame_step=mball_frame_step, n_substeps=mball_n_substeps, noise_seed=mball_noise_seed, keyframe_tolerance=mball_keyframe_tolerance, compute_pool=compute_pool,
+                detect_collisions=(mball_collision_color is not None))
+        if mball_collision_color is not None:
+            # For aggregation, mballs change color when they stick.
+            keyframe_mball_collision_colors(all_mballs, curve_draw_sim.trajectory_frames(n_frames, mball_frame_step), first_steps, mball_collision_color)
+    finally:
+        if compute_pool is not None:
+            compute_pool.shutdown()
+
+    if mball_lod is not None:
+        scene = bpy.context.scene
+        if scene.camera is None:
+            print("No scene camera, metaball LOD skipped.")
+        elif mball_lod == "per_frame":
+            register_mball_lod_handler(all_mballs, mball_lod_target_pixels, mball_lod_min_resolution, mball_lod_max_resolution)
+        else:
+            update_mball_lod(all_mballs, scene.camera, scene, mball_lod_target_pixels, mball_lod_min_resolution, mball_lod_max_resolution)
 
 #
 # Script entry point.